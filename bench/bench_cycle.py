@@ -0,0 +1,132 @@
+"""
+Full cleanup cycles against a synthetic library and a local qBittorrent stand-in.
+
+For each size, generates a sparse library (synth_library.py), serves it from
+fake_qbittorrent.py and runs a cold and warm cycles of run_cleanup() in a fresh
+interpreter (qbit_cleanup reads its config at import). Reports per-stage wall
+time, bytes read for quickhashes and Web API calls per cycle.
+
+    python bench/bench_cycle.py [--sizes 1000,10000,100000] [--cycles 2] [--quickhash]
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+from synth_library import MIB, generate  # noqa: E402
+
+STAGES = ('visibility', 'catalog', 'shield', 'stage1', 'stage2', 'evaluate', 'checkpoint')
+RESULT = 'BENCH_RESULT '
+_SAMPLE = re.compile(r'^(\w+)(?:\{(.*)\})? (\S+)$')
+
+def _metrics(q):
+    """Flatten METRICS.render() into {(name, labels): value}."""
+    out = {}
+    for line in q.METRICS.render().splitlines():
+        m = _SAMPLE.match(line)
+        if m:
+            out[(m.group(1), m.group(2) or '')] = float(m.group(3))
+    return out
+
+def _delta(after, before, name, labels=''):
+    return after.get((name, labels), 0) - before.get((name, labels), 0)
+
+def child(root, cycles, quickhash):
+    """Runs inside the per-size interpreter; prints one RESULT line per cycle."""
+    from fake_qbittorrent import FakeQbittorrent
+    with open(os.path.join(root, 'state.json')) as f:
+        fake = FakeQbittorrent(json.load(f)).start()
+    os.environ.update({
+        'QBITTORRENT_URL': fake.url, 'QBITTORRENT_USER': 'bench', 'QBITTORRENT_PASS': 'bench',
+        'DOWNLOADS_DIR': os.path.join(root, 'downloads'),
+        'MEDIA_DIRS': ','.join(os.path.join(root, 'media', d) for d in ('movies', 'tv')),
+        'CACHE_DIR': os.path.join(root, 'cache'),
+        'MIN_SIZE_MB': '0', 'FAILSAFE_MIN_MEDIA_FILES': '1', 'STATE_CHECKPOINT_SECONDS': '0',
+    })
+    sys.path.insert(0, os.path.dirname(HERE))
+    import qbit_cleanup as q
+    if quickhash:
+        # Pretend the media dirs sit on another device so every lookup takes the quickhash path.
+        walk_media_library = q.walk_media_library
+        def _other_device(*a, **kw):
+            walk = walk_media_library(*a, **kw)
+            walk.root_devs = set()
+            return walk
+        q.walk_media_library = _other_device
+
+    for n in range(cycles):
+        fake.reset_counters()
+        before = _metrics(q)
+        t0 = time.perf_counter()
+        q.run_cleanup()
+        total = time.perf_counter() - t0
+        after = _metrics(q)
+        stages = {s: _delta(after, before, 'qbit_tagger_stage_seconds_sum', f'stage="{s}"') for s in STAGES}
+        print(RESULT + json.dumps({
+            'cycle': 'cold' if n == 0 else f'warm{n}' if cycles > 2 else 'warm',
+            'total': total, 'stages': stages,
+            'hashed': _delta(after, before, 'qbit_tagger_hashed_bytes_total'),
+            'calls': dict(fake.calls),
+        }), flush=True)
+    if q._STATE:
+        q._STATE.close()
+    fake.stop()
+
+def run_size(args, n_torrents):
+    root = tempfile.mkdtemp(prefix=f'qbt-bench-{n_torrents}-', dir=args.dir)
+    try:
+        t0 = time.perf_counter()
+        state = generate(root, n_torrents, args.files_per_torrent, args.size_mb,
+                         args.link_ratio, args.crossseed_ratio)
+        gen_secs = time.perf_counter() - t0
+        cmd = [sys.executable, os.path.abspath(__file__), '--child', root, '--cycles', str(args.cycles)]
+        if args.quickhash:
+            cmd.append('--quickhash')
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        if args.verbose:
+            sys.stdout.write(''.join(l + '\n' for l in proc.stdout.splitlines() if not l.startswith(RESULT)))
+        rows = [json.loads(l[len(RESULT):]) for l in proc.stdout.splitlines() if l.startswith(RESULT)]
+        return len(state['torrents']), gen_secs, rows
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument('--sizes', default='1000,10000,100000', help='comma-separated torrent counts')
+    ap.add_argument('--cycles', type=int, default=2, help='cycles per size; the first one is cold')
+    ap.add_argument('--files-per-torrent', type=int, default=1)
+    ap.add_argument('--size-mb', type=int, default=1024, help='apparent size per file (sparse)')
+    ap.add_argument('--link-ratio', type=float, default=0.7)
+    ap.add_argument('--crossseed-ratio', type=float, default=0.1)
+    ap.add_argument('--quickhash', action='store_true', help='treat media as another device (quickhash path)')
+    ap.add_argument('--dir', default=None, help='where to build libraries (default: system temp dir)')
+    ap.add_argument('--keep', action='store_true', help='keep generated libraries')
+    ap.add_argument('--verbose', action='store_true', help='show qbit_cleanup log output')
+    ap.add_argument('--child', help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        return child(args.child, args.cycles, args.quickhash)
+
+    cols = ('total',) + STAGES
+    print(f"{'torrents':>9} {'cycle':>6} " + ' '.join(f"{c:>10}" for c in cols)
+          + f" {'hashed MiB':>10} {'API calls':>9}  calls by endpoint")
+    for n in (int(s) for s in args.sizes.split(',') if s.strip()):
+        count, gen_secs, rows = run_size(args, n)
+        for r in rows:
+            secs = [r['total']] + [r['stages'][s] for s in STAGES]
+            by_ep = ', '.join(f"{ep}={c}" for ep, c in sorted(r['calls'].items()))
+            print(f"{count:>9} {r['cycle']:>6} " + ' '.join(f"{s:>9.3f}s" for s in secs)
+                  + f" {r['hashed'] / MIB:>10.1f} {sum(r['calls'].values()):>9}  {by_ep}")
+        print(f"{'':>9} {'':>6} (library generated in {gen_secs:.1f}s)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Media index in the SQLite cache store: folding walks in and looking sizes up.
+
+Builds synthetic MediaWalks (no files on disk) and times, per library size,
+CacheStore.apply_media_walk for the first walk (every row inserted) and for a
+walk in which --changed-pct of the directories changed, then
+CacheStore.media_by_sizes for --lookups wanted sizes, as Stage 2 issues them.
+The store is an on-disk cache.db in a temporary directory, committed after
+each step like DaemonState does.
+
+    python bench/bench_media_cache.py [--sizes 10000,100000,1000000] [--files-per-dir 8]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import qbit_cleanup  # noqa: E402
+
+ROOT = '/media/tv'
+
+def make_walk(n_dirs, files_per_dir, known, generation=0, changed=()):
+    """A walk over n_dirs season directories; dirs in `changed` (or all, without `known`) are re-listed."""
+    walk = qbit_cleanup.MediaWalk()
+    walk.roots = [ROOT]
+    walk.known_fingerprints = known
+    for d in range(n_dirs):
+        path = f"{ROOT}/Show {d // 10:05d}/Season {d % 10:02d}"
+        gen = generation if d in changed or not known else 0
+        walk.fingerprints[path] = qbit_cleanup.DirNode(f"1:{d}:{gen}", files_per_dir, (), None)
+        if d in changed or not known:
+            walk.dir_files[path] = {
+                f"E{f:02d}.mkv": (1_000_000_000 + d * files_per_dir + f + gen, 1_700_000_000, d * 100 + f, 1)
+                for f in range(files_per_dir)}
+    walk.fingerprints[ROOT] = qbit_cleanup.DirNode(f"1:0:{generation}", 0, (), str(generation))
+    return walk
+
+def run(n_entries, files_per_dir, changed_pct, lookups, workdir):
+    n_dirs = max(1, n_entries // files_per_dir)
+    store = qbit_cleanup.CacheStore(os.path.join(workdir, 'cache.db'))
+    try:
+        known = {}
+        t0 = time.perf_counter()
+        store.apply_media_walk(make_walk(n_dirs, files_per_dir, known))
+        store.commit()
+        cold = time.perf_counter() - t0
+
+        rng = random.Random(n_entries)
+        changed = set(rng.sample(range(n_dirs), max(1, int(n_dirs * changed_pct / 100))))
+        walk = make_walk(n_dirs, files_per_dir, known, generation=1, changed=changed)
+        t0 = time.perf_counter()
+        store.apply_media_walk(walk)
+        store.commit()
+        incremental = time.perf_counter() - t0
+
+        sizes = [1_000_000_000 + rng.randrange(n_dirs * files_per_dir) for _ in range(lookups)]
+        t0 = time.perf_counter()
+        found = sum(1 for _ in store.media_by_sizes(sizes))
+        lookup = time.perf_counter() - t0
+        return n_dirs, cold, len(changed), incremental, found, lookup
+    finally:
+        store.close()
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument('--sizes', default='10000,100000,1000000', help='comma-separated media file counts')
+    ap.add_argument('--files-per-dir', type=int, default=8)
+    ap.add_argument('--changed-pct', type=float, default=1.0, help='share of directories changed between walks')
+    ap.add_argument('--lookups', type=int, default=1000, help='wanted sizes looked up per run')
+    args = ap.parse_args()
+    print(f"{'entries':>10} {'dirs':>8} {'first walk':>11} {'changed dirs':>13} {'next walk':>10} "
+          f"{'lookups':>8} {'rows':>6} {'lookup':>9}")
+    for n in (int(x) for x in args.sizes.split(',') if x.strip()):
+        workdir = tempfile.mkdtemp(prefix='qbt-bench-cache-')
+        try:
+            n_dirs, cold, changed, incremental, found, lookup = run(
+                n, args.files_per_dir, args.changed_pct, args.lookups, workdir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        print(f"{n:>10} {n_dirs:>8} {cold:>10.2f}s {changed:>13} {incremental:>9.2f}s "
+              f"{args.lookups:>8} {found:>6} {lookup:>8.3f}s")
+
+if __name__ == '__main__':
+    main()
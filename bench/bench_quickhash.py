@@ -0,0 +1,79 @@
+"""
+Quickhash throughput at 1/4/16 workers per device on a synthetic tree.
+
+Files are sparse: only the first and last MiB (the ranges quickhash reads) hold
+data, so a multi-GiB tree costs a few MiB of disk per file. Before every run the
+tree is evicted from the page cache with POSIX_FADV_DONTNEED so each run reads
+from the device. Point --dir at a directory on the array or NFS mount you care
+about; the default is a temporary directory.
+
+    python bench/bench_quickhash.py [--dir PATH] [--files 200] [--size-mb 2048] [--workers 1,4,16]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import qbit_cleanup  # noqa: E402
+
+MIB = 1024 * 1024
+
+def make_tree(root, n_files, size_bytes):
+    paths = []
+    for i in range(n_files):
+        d = os.path.join(root, f"Show {i // 20:03d}", f"Season {i % 20 // 10 + 1:02d}")
+        os.makedirs(d, exist_ok=True)
+        p = os.path.join(d, f"E{i:04d}.mkv")
+        with open(p, 'wb') as f:
+            f.write(os.urandom(MIB))
+            f.truncate(size_bytes)
+            f.seek(size_bytes - MIB)
+            f.write(os.urandom(MIB))
+        paths.append(p)
+    return paths
+
+def evict(paths):
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for p in paths:
+        fd = os.open(p, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+def run(paths, workers):
+    evict(paths)
+    budget = qbit_cleanup.Budget(len(paths) * 2 + 1, workers=workers)
+    dev = os.stat(paths[0]).st_dev
+    t0 = time.perf_counter()
+    results = qbit_cleanup.quick_hash_many(((p, p, dev) for p in paths), budget, qbit_cleanup.HOST)
+    secs = time.perf_counter() - t0
+    assert all(results.values()) and not budget.exhausted
+    return secs, (budget.total - budget.remaining) / MIB
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument('--dir', help='parent directory for the synthetic tree (default: system temp)')
+    ap.add_argument('--files', type=int, default=200)
+    ap.add_argument('--size-mb', type=int, default=2048, help='apparent size of each file')
+    ap.add_argument('--workers', default='1,4,16')
+    args = ap.parse_args()
+
+    root = tempfile.mkdtemp(prefix='qh-bench-', dir=args.dir)
+    try:
+        paths = make_tree(root, args.files, max(2, args.size_mb) * MIB)
+        print(f"{args.files} files x {args.size_mb} MiB (sparse) under {root}")
+        print(f"{'workers':>8} {'seconds':>9} {'MiB read':>9} {'MiB/s':>8} {'files/s':>8}")
+        for w in (int(x) for x in args.workers.split(',') if x.strip()):
+            secs, mib = run(paths, w)
+            print(f"{w:>8} {secs:>9.2f} {mib:>9.0f} {mib / secs:>8.1f} {len(paths) / secs:>8.1f}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
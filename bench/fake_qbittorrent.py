@@ -0,0 +1,174 @@
+"""
+Local stand-in for the qBittorrent Web API endpoints qbit_cleanup.py uses.
+
+Serves auth/login, torrents/info (with `hashes=`), torrents/files,
+torrents/addTags, torrents/removeTags, sync/maindata (rid deltas),
+transfer/info and app/version from an in-memory state, and counts calls and
+server-side time per endpoint. Use it in-process (FakeQbittorrent) or
+standalone with a state file written by synth_library.py:
+
+    python bench/fake_qbittorrent.py state.json [--port 8080]
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+class FakeQbittorrent:
+    """
+    state: {'torrents': [torrent dicts with 'hash'], 'files': {hash: [file dicts]}}.
+    Every torrent carries a version; sync/maindata returns the torrents changed
+    since the caller's rid, like qBittorrent does.
+    """
+    def __init__(self, state, port=0, upload_speed=0):
+        self.torrents = {t['hash']: dict(t) for t in state['torrents']}
+        self.files = state['files']
+        self.upload_speed = upload_speed
+        self.rid = 1
+        self.versions = {h: 1 for h in self.torrents}
+        self.calls = {}
+        self.seconds = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), _handler(self))
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls.clear()
+            self.seconds.clear()
+
+    def touch(self, infohash, **fields):
+        """Change a torrent as qBittorrent would (e.g. tags, last_activity)."""
+        with self.lock:
+            self.torrents[infohash].update(fields)
+            self.rid += 1
+            self.versions[infohash] = self.rid
+
+    # --- endpoint bodies (called with self.lock held)
+    def _info(self, p):
+        ts = self.torrents.values()
+        if p.get('hashes'):
+            wanted = set(p['hashes'].split('|'))
+            ts = [t for t in ts if t['hash'] in wanted]
+        return list(ts)
+
+    def _maindata(self, p):
+        since = int(p.get('rid') or 0)
+        if since <= 0 or since > self.rid:
+            return {'rid': self.rid, 'full_update': True,
+                    'torrents': {h: dict(t) for h, t in self.torrents.items()}}
+        return {'rid': self.rid,
+                'torrents': {h: dict(self.torrents[h]) for h, v in self.versions.items() if v > since}}
+
+    def _tags(self, p, add):
+        wanted = set(p.get('hashes', '').split('|'))
+        tags = [x.strip() for x in p.get('tags', '').split(',') if x.strip()]
+        for h in wanted:
+            t = self.torrents.get(h)
+            if t is None:
+                continue
+            cur = [x for x in (t.get('tags') or '').split(', ') if x]
+            new = cur + [x for x in tags if x not in cur] if add else [x for x in cur if x not in tags]
+            if new != cur:
+                t['tags'] = ', '.join(new)
+                self.rid += 1
+                self.versions[h] = self.rid
+
+def _handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        wbufsize = 1 << 16  # headers and body in one write; unbuffered writes hit Nagle + delayed ACK
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code, body, ctype='application/json', headers=None):
+            if not isinstance(body, bytes):
+                body = (json.dumps(body) if ctype == 'application/json' else body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _params(self):
+            u = urlparse(self.path)
+            p = {k: v[0] for k, v in parse_qs(u.query).items()}
+            if self.command == 'POST':
+                n = int(self.headers.get('Content-Length') or 0)
+                p.update({k: v[0] for k, v in parse_qs(self.rfile.read(n).decode()).items()})
+            return u.path.split('/api/v2/', 1)[-1], p
+
+        def do_GET(self):
+            self._dispatch()
+
+        def do_POST(self):
+            self._dispatch()
+
+        def _dispatch(self):
+            start = time.perf_counter()
+            ep, p = self._params()
+            try:
+                self._route(ep, p)
+            finally:
+                with fake.lock:
+                    fake.calls[ep] = fake.calls.get(ep, 0) + 1
+                    fake.seconds[ep] = fake.seconds.get(ep, 0.0) + time.perf_counter() - start
+
+        def _route(self, ep, p):
+            if ep == 'auth/login':
+                return self._send(200, 'Ok.', 'text/plain', {'Set-Cookie': 'SID=bench; path=/'})
+            if 'SID=bench' not in (self.headers.get('Cookie') or ''):
+                return self._send(403, 'Forbidden', 'text/plain')
+            with fake.lock:
+                if ep == 'torrents/info':
+                    body = fake._info(p)
+                elif ep == 'torrents/files':
+                    body = fake.files.get((p.get('hash') or '').lower(), [])
+                elif ep == 'sync/maindata':
+                    body = fake._maindata(p)
+                elif ep in ('torrents/addTags', 'torrents/removeTags'):
+                    fake._tags(p, ep.endswith('addTags'))
+                    body = ''
+                elif ep == 'transfer/info':
+                    body = {'up_info_speed': fake.upload_speed, 'dl_info_speed': 0}
+                elif ep == 'app/version':
+                    body = 'v4.6.0'
+                else:
+                    return self._send(404, 'Not Found', 'text/plain')
+            if isinstance(body, str):
+                return self._send(200, body, 'text/plain')
+            return self._send(200, body)
+    return Handler
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument('state', help='JSON state written by synth_library.py')
+    ap.add_argument('--port', type=int, default=8080)
+    args = ap.parse_args()
+    with open(args.state) as f:
+        fake = FakeQbittorrent(json.load(f), port=args.port)
+    print(f"serving {len(fake.torrents)} torrents at {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
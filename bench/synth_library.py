@@ -0,0 +1,94 @@
+"""
+Synthetic downloads + media library for benchmarking full cycles.
+
+Creates sparse files (no data blocks, so 100k torrents fit anywhere) under
+<dir>/downloads with matching torrents/files metadata, hardlinks a share of
+them into <dir>/media/movies and adds cross-seed torrents that hardlink an
+existing download under <dir>/downloads/xseed. Writes <dir>/state.json for
+fake_qbittorrent.py.
+
+    python bench/synth_library.py --dir /tmp/lib [--torrents 10000] [--link-ratio 0.7]
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import time
+
+MIB = 1024 * 1024
+FILLER_MEDIA = 10  # media-only files so FAILSAFE_MIN_MEDIA_FILES passes on tiny libraries
+
+def _sparse(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+def _torrent(infohash, name, save_path, size, old):
+    return {'hash': infohash, 'name': name, 'save_path': save_path, 'state': 'stalledUP', 'tags': '',
+            'size': size, 'completion_on': old, 'last_activity': old, 'upspeed': 0}
+
+def generate(root, torrents=1000, files_per_torrent=1, size_mb=1024, link_ratio=0.7,
+             crossseed_ratio=0.1, seed=1):
+    """Build the tree under root and return the fake server state."""
+    rng = random.Random(seed)
+    downloads = os.path.join(root, 'downloads')
+    movies = os.path.join(root, 'media', 'movies')
+    os.makedirs(movies, exist_ok=True)
+    old = int(time.time()) - 30 * 86400
+    state = {'torrents': [], 'files': {}}
+    originals = []
+
+    for i in range(torrents):
+        name = f"Movie.{i:06d}.1080p"
+        infohash = hashlib.sha1(f"t{seed}:{i}".encode()).hexdigest()
+        files = []
+        linked = rng.random() < link_ratio
+        for j in range(files_per_torrent):
+            rel = f"{name}/{name}.part{j}.mkv" if files_per_torrent > 1 else f"{name}/{name}.mkv"
+            size = size_mb * MIB + i * files_per_torrent + j  # unique sizes, like real releases
+            path = os.path.join(downloads, rel)
+            _sparse(path, size)
+            if linked:
+                dest = os.path.join(movies, f"Movie {i:06d} ({1990 + i % 35})", os.path.basename(rel))
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                os.link(path, dest)
+            files.append({'name': rel, 'size': size})
+        state['torrents'].append(_torrent(infohash, name, downloads, sum(f['size'] for f in files), old))
+        state['files'][infohash] = files
+        originals.append((name, files))
+
+    xseed = os.path.join(downloads, 'xseed')
+    for k, (name, files) in enumerate(rng.sample(originals, int(len(originals) * crossseed_ratio))):
+        infohash = hashlib.sha1(f"x{seed}:{k}".encode()).hexdigest()
+        for f in files:
+            dest = os.path.join(xseed, f['name'])
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.link(os.path.join(downloads, f['name']), dest)
+        state['torrents'].append(_torrent(infohash, name, xseed, sum(f['size'] for f in files), old))
+        state['files'][infohash] = [dict(f) for f in files]
+
+    for k in range(FILLER_MEDIA):
+        _sparse(os.path.join(root, 'media', 'tv', 'Filler', f"E{k:02d}.mkv"), size_mb * MIB - k - 1)
+
+    with open(os.path.join(root, 'state.json'), 'w') as f:
+        json.dump(state, f)
+    return state
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument('--dir', required=True)
+    ap.add_argument('--torrents', type=int, default=1000)
+    ap.add_argument('--files-per-torrent', type=int, default=1)
+    ap.add_argument('--size-mb', type=int, default=1024, help='apparent size per file (sparse)')
+    ap.add_argument('--link-ratio', type=float, default=0.7, help='share of torrents hardlinked into media')
+    ap.add_argument('--crossseed-ratio', type=float, default=0.1, help='extra torrents sharing an existing download')
+    ap.add_argument('--seed', type=int, default=1)
+    args = ap.parse_args()
+    t0 = time.perf_counter()
+    state = generate(args.dir, args.torrents, args.files_per_torrent, args.size_mb,
+                     args.link_ratio, args.crossseed_ratio, args.seed)
+    print(f"{len(state['torrents'])} torrents under {args.dir} in {time.perf_counter() - t0:.1f}s")
+
+if __name__ == '__main__':
+    main()
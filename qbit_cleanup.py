@@ -1,13 +1,31 @@
 import os
 import time
 import json
+import sqlite3
+import ctypes
+import ctypes.util
+import bisect
+import errno
+import signal
+import struct
+import sys
 import tempfile
+import tarfile
+import gzip
+import shutil
+import cProfile
+import pstats
+import io
+import tracemalloc
 from datetime import datetime
-from collections import defaultdict
-from qbittorrent import Client
+from collections import defaultdict, deque, namedtuple
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 import hashlib
 import uuid
+from urllib.parse import quote
 
 VERSION = "no-hardlink-tagger v3.0 — cache + two-stage + budget"
 
@@ -17,13 +35,16 @@ VERSION = "no-hardlink-tagger v3.0 — cache + two-stage + budget"
 QBITTORRENT_URL  = os.environ.get('QBITTORRENT_URL', '').rstrip('/')
 QBITTORRENT_USER = os.environ.get('QBITTORRENT_USER')
 QBITTORRENT_PASS = os.environ.get('QBITTORRENT_PASS')
+# Several instances sharing one media index: a JSON list (inline, or the path of a JSON file) of
+# {"name", "url", "user", "pass", "downloads_dir", "orphan_tag", "tag_prefix"}; replaces the three above
+QB_INSTANCES     = os.environ.get('QB_INSTANCES', '').strip()
 
 ORPHAN_TAG    = os.environ.get('ORPHAN_TAG', 'NoMediaLink')
 DOWNLOADS_DIR = os.environ.get('DOWNLOADS_DIR', '/media/downloads')
 MEDIA_DIRS    = [d.strip() for d in os.environ.get('MEDIA_DIRS', '/media/movies,/media/tv').split(',')]
 
 DEBUG_INTERVAL = int(os.environ.get('DEBUG_INTERVAL', '60'))
-BATCH_SIZE     = int(os.environ.get('BATCH_SIZE', '25'))
+BATCH_SIZE     = int(os.environ.get('BATCH_SIZE', '0'))  # max hashes per tag write; 0 = as many as fit one request
 MAX_TORRENTS   = int(os.environ.get('MAX_TORRENTS', '0'))  # 0 = all
 
 EXT_WHITELIST  = [e.strip().lower() for e in os.environ.get(
@@ -55,6 +76,23 @@ FAILSAFE_MAX_INDEX_ERRORS  = int(os.environ.get('FAILSAFE_MAX_INDEX_ERRORS', '20
 ACTIVE_GRACE_MINUTES       = int(os.environ.get('ACTIVE_GRACE_MINUTES', '30'))
 MIN_COMPLETED_AGE_HOURS    = int(os.environ.get('MIN_COMPLETED_AGE_HOURS', '24'))
 
+# Media watcher (inotify): incremental media index between full walks
+MEDIA_WATCH                = os.environ.get('MEDIA_WATCH', '0').lower() in ('1', 'true', 'yes', 'on')
+MEDIA_WATCH_RESCAN_HOURS   = int(os.environ.get('MEDIA_WATCH_RESCAN_HOURS', '24'))  # safety-net full walk; 0 = never
+
+# Web API connection pool (one keep-alive session shared by reads and writes)
+QB_POOL_SIZE               = max(1, int(os.environ.get('QB_POOL_SIZE', '4')))
+QB_TIMEOUT                 = int(os.environ.get('QB_TIMEOUT', '15'))
+QB_FILES_WORKERS           = max(1, int(os.environ.get('QB_FILES_WORKERS', str(QB_POOL_SIZE))))
+
+# Load-aware backoff: scale hashing down while qBittorrent or the disks are busy
+LOAD_AWARE                 = os.environ.get('LOAD_AWARE', '0').lower() in ('1', 'true', 'yes', 'on')
+LOAD_TRANSFER_MB           = float(os.environ.get('LOAD_TRANSFER_MB', '50'))   # up+down MiB/s that counts as busy
+LOAD_IO_PERCENT            = float(os.environ.get('LOAD_IO_PERCENT', '20'))    # io stall (PSI) or busiest-disk % that counts as busy
+
+# Hardlink accounting: files whose every link is inside DOWNLOADS_DIR skip the media lookup
+NLINK_ACCOUNTING           = os.environ.get('NLINK_ACCOUNTING', '0').lower() in ('1', 'true', 'yes', 'on')
+
 # Active-inode shield
 ACTIVE_INODE_SHIELD        = os.environ.get('ACTIVE_INODE_SHIELD', '1') not in ('0','false','False')
 
@@ -62,10 +100,28 @@ ACTIVE_INODE_SHIELD        = os.environ.get('ACTIVE_INODE_SHIELD', '1') not in (
 CACHE_DIR                  = os.environ.get('CACHE_DIR', '/cache')
 HASH_BUDGET_MB             = int(os.environ.get('HASH_BUDGET_MB', '1024'))  # total MiB to read this run
 DECISION_TTL_HOURS         = int(os.environ.get('DECISION_TTL_HOURS', '24')) # reuse result for unchanged torrents
+HASH_WORKERS_PER_DEVICE    = max(1, int(os.environ.get('HASH_WORKERS_PER_DEVICE', '4')))  # concurrent quickhash reads per device
+HASH_RATE_MB               = float(os.environ.get('HASH_RATE_MB', '0'))  # MiB/s for quickhash reads; 0 = unthrottled
+HASH_RATE_PER_DEVICE       = os.environ.get('HASH_RATE_PER_DEVICE', '0').lower() in ('1', 'true', 'yes', 'on')
+STATE_CHECKPOINT_SECONDS   = int(os.environ.get('STATE_CHECKPOINT_SECONDS', '300'))  # min seconds between cache commits; 0 = every cycle
+
+# Metrics (Prometheus text format); 0 = no endpoint
+METRICS_PORT               = int(os.environ.get('METRICS_PORT', '0'))
+METRICS_ADDR               = os.environ.get('METRICS_ADDR', '0.0.0.0')
+
+# Profiling: comma-separated cprofile, tracemalloc and/or sample; files go to CACHE_DIR/profiles
+PROFILE                    = {m.strip().lower() for m in os.environ.get('PROFILE', '').split(',') if m.strip()}
+PROFILE_KEEP               = max(1, int(os.environ.get('PROFILE_KEEP', '20')))            # cycles kept on disk
+PROFILE_MIN_SECONDS        = float(os.environ.get('PROFILE_MIN_SECONDS', '0'))            # only keep cycles at least this slow
+PROFILE_SAMPLE_MS          = max(1, int(os.environ.get('PROFILE_SAMPLE_MS', '10')))       # sampler interval
+SNAPSHOT_RECORD            = os.environ.get('SNAPSHOT_RECORD', '0').lower() in ('1', 'true', 'yes', 'on')  # record the first cycle to CACHE_DIR/snapshots
 
 # Logging style
 LOG_USE_AMPM               = os.environ.get('LOG_USE_AMPM', '0').lower() in ('1', 'true', 'yes', 'on')
 ACTION_LOG_PATH            = os.environ.get('ACTION_LOG_PATH')  # optional override; defaults to CACHE_DIR/actions.log
+ACTION_LOG_MAX_MB          = float(os.environ.get('ACTION_LOG_MAX_MB', '64'))      # rotate the action log past this size; 0 = no limit
+ACTION_LOG_ROTATE_HOURS    = float(os.environ.get('ACTION_LOG_ROTATE_HOURS', '168'))  # ... or once it is this old; 0 = no limit
+ACTION_LOG_KEEP            = int(os.environ.get('ACTION_LOG_KEEP', '0'))           # rotated segments kept; 0 = all
 
 # =========================
 # Logging
@@ -76,11 +132,22 @@ def _timestamp():
         return now.strftime("%Y-%m-%d %I:%M:%S %p")
     return now.isoformat(sep=' ', timespec='seconds')
 
+_LOG_CTX = threading.local()  # .prefix: instance name for lines logged while working on it
+
 def log(msg):
-    print(f"[{_timestamp()}] {msg}", flush=True)
+    # one write per line, so lines from concurrent instances do not interleave
+    sys.stdout.write(f"[{_timestamp()}] {getattr(_LOG_CTX, 'prefix', '')}{msg}\n")
+    sys.stdout.flush()
 
 _ACTION_LOG_WARN_INTERVAL = 60  # seconds
-_last_action_log_warn = 0
+_ACTION_LOG_MAX_BUFFER = 100000  # entries held across failed flushes before the oldest are dropped
+
+_ACTION_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (name TEXT PRIMARY KEY, started REAL NOT NULL, indexed INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS actions (hash TEXT, run_id TEXT, segment TEXT NOT NULL, pos INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS actions_hash ON actions (hash);
+CREATE INDEX IF NOT EXISTS actions_run ON actions (run_id);
+"""
 
 def _action_log_path():
     if ACTION_LOG_PATH:
@@ -92,58 +159,907 @@ def _action_log_path():
     parent = os.path.dirname(path) or '.'
     return path if _ensure_dir(parent) else None
 
+class ActionLog:
+    """
+    JSONL log of tag actions, buffered in memory and appended once per cycle by
+    flush(). The active file rotates by size or age into gzip segments next to
+    it, and a sidecar SQLite index (<log>.idx) maps torrent hashes and run ids
+    to (segment, byte offset) so lookup() reads only the matching lines.
+    """
+    def __init__(self):
+        self.buffer = []
+        self.path = None
+        self.idx = None
+        self._last_warn = 0
+
+    def write(self, entries):
+        self.buffer.extend(entries)
+
+    def _warn(self, msg):
+        now = time.time()
+        if now - self._last_warn >= _ACTION_LOG_WARN_INTERVAL:
+            log(msg)
+            self._last_warn = now
+
+    def _index(self):
+        if self.idx is None:
+            self.path = _action_log_path()
+            if not self.path:
+                return None
+            self.idx = sqlite3.connect(self.path + '.idx')
+            self.idx.executescript(_ACTION_INDEX_SCHEMA)
+        return self.idx
+
+    def flush(self):
+        if not self.buffer:
+            return
+        try:
+            idx = self._index()
+            if idx is None:
+                self.buffer.clear()
+                return
+            active = os.path.basename(self.path)
+            self._catch_up(idx, active)
+            rows, data = [], []
+            with open(self.path, 'ab') as f:
+                pos = start = f.tell()
+                for e in self.buffer:
+                    line = (json.dumps(e, separators=(',', ':'), ensure_ascii=False) + '\n').encode('utf-8')
+                    rows.append((e.get('hash'), e.get('run_id'), active, pos))
+                    data.append(line)
+                    pos += len(line)
+                f.write(b''.join(data))
+            self.buffer.clear()
+            with idx:
+                idx.execute("INSERT OR IGNORE INTO segments (name, started, indexed) VALUES (?, ?, ?)",
+                            (active, time.time(), start))
+                idx.executemany("INSERT INTO actions (hash, run_id, segment, pos) VALUES (?, ?, ?, ?)", rows)
+                idx.execute("UPDATE segments SET indexed=? WHERE name=?", (pos, active))
+            self._maybe_rotate(idx, active)
+        except Exception as e:
+            del self.buffer[:-_ACTION_LOG_MAX_BUFFER]
+            self._warn(f"⚠️ action log write failed: {e}")
+
+    def close(self):
+        """Write what is buffered and let go of the index; the next write opens it again."""
+        self.flush()
+        if self.idx is not None:
+            self.idx.close()
+            self.idx = self.path = None
+
+    def _catch_up(self, idx, active):
+        """Index lines the index missed: a log from before the index existed, or a failed index write."""
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        row = idx.execute("SELECT indexed FROM segments WHERE name=?", (active,)).fetchone()
+        done = row[0] if row else 0
+        if done == size:
+            return
+        rows = []
+        with idx:
+            if done > size:  # replaced underneath us
+                idx.execute("DELETE FROM actions WHERE segment=?", (active,))
+                done = 0
+            with open(self.path, 'rb') as f:
+                f.seek(done)
+                for line in f:
+                    try:
+                        e = json.loads(line)
+                        rows.append((e.get('hash'), e.get('run_id'), active, done))
+                    except ValueError:
+                        pass
+                    done += len(line)
+            idx.execute("INSERT OR REPLACE INTO segments (name, started, indexed) VALUES (?, COALESCE("
+                        "(SELECT started FROM segments WHERE name=?), ?), ?)", (active, active, time.time(), done))
+            idx.executemany("INSERT INTO actions (hash, run_id, segment, pos) VALUES (?, ?, ?, ?)", rows)
+
+    def _maybe_rotate(self, idx, active):
+        size = os.path.getsize(self.path)
+        started = idx.execute("SELECT started FROM segments WHERE name=?", (active,)).fetchone()[0]
+        if not ((ACTION_LOG_MAX_MB > 0 and size >= ACTION_LOG_MAX_MB * 1024 * 1024) or
+                (ACTION_LOG_ROTATE_HOURS > 0 and time.time() - started >= ACTION_LOG_ROTATE_HOURS * 3600)):
+            return
+        root, ext = os.path.splitext(active)
+        name = f"{root}-{datetime.now().strftime('%Y%m%d-%H%M%S')}{ext}.gz"
+        n = 1
+        while os.path.exists(os.path.join(os.path.dirname(self.path), name)):
+            name = f"{root}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{n}{ext}.gz"
+            n += 1
+        target = os.path.join(os.path.dirname(self.path), name)
+        with open(self.path, 'rb') as src, gzip.open(target + '.tmp', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(target + '.tmp', target)
+        with idx:
+            idx.execute("UPDATE actions SET segment=? WHERE segment=?", (name, active))
+            idx.execute("UPDATE segments SET name=? WHERE name=?", (name, active))
+        os.remove(self.path)
+        log(f"🗜 Action log rotated to {name} ({size / 1024 / 1024:.1f} MiB).")
+        if ACTION_LOG_KEEP > 0:
+            old = [r[0] for r in idx.execute("SELECT name FROM segments WHERE name != ? ORDER BY started DESC "
+                                             "LIMIT -1 OFFSET ?", (active, ACTION_LOG_KEEP))]
+            with idx:
+                for seg in old:
+                    idx.execute("DELETE FROM actions WHERE segment=?", (seg,))
+                    idx.execute("DELETE FROM segments WHERE name=?", (seg,))
+            for seg in old:
+                try:
+                    os.remove(os.path.join(os.path.dirname(self.path), seg))
+                except FileNotFoundError:
+                    pass
+
+    def lookup(self, key):
+        """Logged entries whose torrent hash or run id is key, oldest first."""
+        self.flush()
+        if self.idx is None:
+            path = _action_log_path()
+            if not path or not (os.path.exists(path) or os.path.exists(path + '.idx')):
+                return  # nothing logged yet; do not leave an empty index behind
+        idx = self._index()
+        if idx is None:
+            return
+        self._catch_up(idx, os.path.basename(self.path))  # e.g. a log written before the index existed
+        key = key.strip().lower()
+        rows = idx.execute("SELECT a.segment, a.pos FROM actions a JOIN segments s ON s.name = a.segment "
+                           "WHERE a.hash=? OR a.run_id=? ORDER BY s.started, a.pos", (key, key)).fetchall()
+        by_segment = defaultdict(list)
+        for seg, pos in rows:
+            by_segment[seg].append(pos)
+        for seg, positions in by_segment.items():
+            path = os.path.join(os.path.dirname(self.path), seg)
+            try:
+                with (gzip.open(path, 'rb') if seg.endswith('.gz') else open(path, 'rb')) as f:
+                    for pos in positions:
+                        f.seek(pos)
+                        yield json.loads(f.readline())
+            except FileNotFoundError:
+                self._warn(f"⚠️ action log segment {seg} is missing")
+
+ACTION_LOG = ActionLog()
+
 def log_actions(entries):
     """
-    Persist important actions (tag/untag/coverage-tag) to a durable log.
+    Queue important actions (tag/untag/coverage-tag) for the durable log;
+    ACTION_LOG.flush() writes them at the end of the cycle.
     Entries: list of dicts already containing timestamp strings.
     """
-    path = _action_log_path()
-    global _last_action_log_warn
-    if not path:
-        return
-    try:
-        with open(path, 'a', encoding='utf-8') as f:
-            for entry in entries:
-                f.write(json.dumps(entry, separators=(',', ':'), ensure_ascii=False))
-                f.write('\n')
-    except Exception as e:
-        now = time.time()
-        if now - _last_action_log_warn >= _ACTION_LOG_WARN_INTERVAL:
-            log(f"⚠️ action log write failed: {e}")
-            _last_action_log_warn = now
+    ACTION_LOG.write(entries)
 
 # =========================
-# qBittorrent helpers
+# Metrics
 # =========================
-def get_qb_client():
+_METRIC_HELP = {
+    'qbit_tagger_cycles_total': ('counter', 'Cleanup cycles by outcome.'),
+    'qbit_tagger_last_cycle_timestamp_seconds': ('gauge', 'Unix time the last cycle finished.'),
+    'qbit_tagger_stage_seconds': ('histogram', 'Time per stage per cycle, summed over instances.'),
+    'qbit_tagger_api_request_seconds': ('histogram', 'qBittorrent Web API latency by endpoint.'),
+    'qbit_tagger_api_requests_total': ('counter', 'qBittorrent Web API requests by endpoint and status.'),
+    'qbit_tagger_hashed_bytes_total': ('counter', 'Bytes read for quickhashes.'),
+    'qbit_tagger_hash_budget_bytes': ('gauge', 'Hash budget of the last cycle, total and used.'),
+    'qbit_tagger_cache_lookups_total': ('counter', 'Cache lookups by cache and result.'),
+    'qbit_tagger_tag_changes_total': ('counter', 'Verified tag writes by action.'),
+    'qbit_tagger_torrents': ('gauge', 'Torrents by remembered decision.'),
+}
+_METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _metric_key(name, labels):
+    # label values are stored as strings so keys always sort, whatever type a caller passed
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+class Metrics:
+    """In-process counters, gauges and histograms rendered in the Prometheus text format."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}  # (name, labels) -> value or [bucket counts..., sum, count]
+        self._stages = None  # stage -> seconds so far in the running cycle
+
+    def inc(self, name, value=1, **labels):
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[_metric_key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = _metric_key(name, labels)
+        with self._lock:
+            h = self._values.setdefault(key, [0] * (len(_METRIC_BUCKETS) + 2))
+            for i, bound in enumerate(_METRIC_BUCKETS):
+                if value <= bound:
+                    h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def time(self, stage):
+        return _StageTimer(self, stage)
+
+    def begin_cycle(self):
+        """Sum stage timings from here until end_cycle() into one observation per stage."""
+        with self._lock:
+            self._stages = defaultdict(float)
+
+    def end_cycle(self):
+        with self._lock:
+            stages, self._stages = self._stages or {}, None
+        for stage, seconds in stages.items():
+            self.observe('qbit_tagger_stage_seconds', seconds, stage=stage)
+
+    def add_stage(self, stage, seconds):
+        with self._lock:
+            if self._stages is not None:
+                self._stages[stage] += seconds
+                return
+        self.observe('qbit_tagger_stage_seconds', seconds, stage=stage)
+
+    def render(self):
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ''
+            esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in items) + '}'
+        with self._lock:
+            values = sorted(self._values.items())
+        out = []
+        seen = set()
+        for (name, labels), v in values:
+            if name not in seen:
+                seen.add(name)
+                kind, help_text = _METRIC_HELP.get(name, ('untyped', ''))
+                out.append(f"# HELP {name} {help_text}")
+                out.append(f"# TYPE {name} {kind}")
+            if isinstance(v, list):
+                for bound, n in zip(_METRIC_BUCKETS, v):
+                    out.append(f"{name}_bucket{fmt(labels, (('le', bound),))} {n}")
+                out.append(f"{name}_bucket{fmt(labels, (('le', '+Inf'),))} {v[-1]}")
+                out.append(f"{name}_sum{fmt(labels)} {v[-2]}")
+                out.append(f"{name}_count{fmt(labels)} {v[-1]}")
+            else:
+                out.append(f"{name}{fmt(labels)} {v}")
+        return '\n'.join(out) + '\n'
+
+class _StageTimer:
+    def __init__(self, metrics, stage):
+        self.metrics, self.stage = metrics, stage
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+    def __exit__(self, *exc):
+        self.metrics.add_stage(self.stage, time.monotonic() - self.start)
+        return False
+
+METRICS = Metrics()
+
+def start_metrics_server(port, addr='0.0.0.0'):
+    """Serve METRICS at /metrics from a daemon thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = METRICS.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, *args):
+            pass
+
     try:
-        qb = Client(QBITTORRENT_URL)
-        qb.login(QBITTORRENT_USER, QBITTORRENT_PASS)
-        return qb
-    except Exception as e:
-        log(f"Error connecting to qBittorrent: {e}")
+        server = ThreadingHTTPServer((addr, port), _Handler)
+    except OSError as e:
+        log(f"⚠ metrics endpoint unavailable on {addr}:{port} ({e}).")
         return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    log(f"📈 Metrics at http://{addr}:{port}/metrics")
+    return server
+
+# =========================
+# Profiling (per cycle)
+# =========================
+class _StackSampler:
+    """
+    Wall-clock sampler: every PROFILE_SAMPLE_MS it records the stack of each
+    thread and counts identical stacks, in flamegraph "folded" format. Cheap
+    enough to leave on; covers the hash and catalog worker threads as well.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.counts = defaultdict(int)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.counts[';'.join([names.get(ident, 'thread')] + stack[::-1])] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.counts
+
+def _profile_dir():
+    path = os.path.join(CACHE_DIR, 'profiles')
+    return path if _ensure_dir(path) else None
+
+def _rotate_profiles(path):
+    stamps = sorted({name.split('.', 1)[0] for name in os.listdir(path) if name.startswith('cycle-')})
+    for stamp in stamps[:-PROFILE_KEEP]:
+        for name in os.listdir(path):
+            if name.split('.', 1)[0] == stamp:
+                try:
+                    os.remove(os.path.join(path, name))
+                except OSError:
+                    pass
 
-def _api_session():
+def run_profiled(fn):
+    """
+    Run one cycle under the profilers named in PROFILE and write
+    CACHE_DIR/profiles/cycle-<time>.{pstats,txt,alloc.txt,folded}, keeping the
+    newest PROFILE_KEEP cycles. cProfile sees the main thread only; use
+    `sample` for the worker pools.
+    """
+    if not PROFILE:
+        return fn()
+    prof = cProfile.Profile() if 'cprofile' in PROFILE else None
+    sampler = _StackSampler(PROFILE_SAMPLE_MS / 1000) if 'sample' in PROFILE else None
+    tracing = 'tracemalloc' in PROFILE
+    if tracing:
+        tracemalloc.start()
+    if sampler:
+        sampler.start()
+    start = time.monotonic()
     try:
-        s = requests.Session()
-        s.headers.update({'Referer': f"{QBITTORRENT_URL}/", 'Origin': QBITTORRENT_URL})
-        r = s.post(f"{QBITTORRENT_URL}/api/v2/auth/login",
-                   data={'username': QBITTORRENT_USER, 'password': QBITTORRENT_PASS},
-                   timeout=10)
-        if r.status_code != 200:
-            return None, f"auth failed: {r.status_code} {r.text}"
-        return s, None
-    except Exception as e:
-        return None, f"auth error: {e}"
+        return prof.runcall(fn) if prof else fn()
+    finally:
+        elapsed = time.monotonic() - start
+        counts = sampler.stop() if sampler else None
+        snapshot = tracemalloc.take_snapshot() if tracing else None
+        peak = tracemalloc.get_traced_memory()[1] if tracing else 0
+        if tracing:
+            tracemalloc.stop()
+        path = _profile_dir() if elapsed >= PROFILE_MIN_SECONDS else None
+        if path:
+            base = os.path.join(path, f"cycle-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')[:-3]}")
+            try:
+                if prof:
+                    prof.dump_stats(f"{base}.pstats")
+                    out = io.StringIO()
+                    pstats.Stats(prof, stream=out).sort_stats('cumulative').print_stats(40)
+                    with open(f"{base}.txt", 'w') as f:
+                        f.write(out.getvalue())
+                if snapshot:
+                    with open(f"{base}.alloc.txt", 'w') as f:
+                        f.write(f"peak traced: {peak / (1024 * 1024):.1f} MiB\n")
+                        for stat in snapshot.statistics('lineno')[:40]:
+                            f.write(f"{stat}\n")
+                if counts:
+                    with open(f"{base}.folded", 'w') as f:
+                        for stack, n in sorted(counts.items()):
+                            f.write(f"{stack} {n}\n")
+                _rotate_profiles(path)
+                log(f"🔬 Profile written to {base}.* ({elapsed:.1f}s cycle).")
+            except OSError as e:
+                log(f"⚠ profile write failed: {e}")
 
-def _api_post(path, data):
-    s, err = _api_session()
-    if err:
-        log(f"❌ API session error: {err}")
+# =========================
+# Snapshots (record / replay)
+# =========================
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_CONFIG = (
+    'ORPHAN_TAG', 'DOWNLOADS_DIR', 'MEDIA_DIRS', 'BATCH_SIZE', 'MAX_TORRENTS', 'EXT_WHITELIST', 'MIN_SIZE_MB',
+    'MEDIA_LINK_MIN_PERCENT', 'MEDIA_LINK_TAG_PREFIX', 'MEDIA_LINK_TAG_STEPS', 'FAILSAFE_ENABLED',
+    'FAILSAFE_REQUIRE_DIRS', 'FAILSAFE_MIN_MEDIA_FILES', 'FAILSAFE_MAX_INDEX_ERRORS', 'ACTIVE_GRACE_MINUTES',
+    'MIN_COMPLETED_AGE_HOURS', 'NLINK_ACCOUNTING', 'ACTIVE_INODE_SHIELD', 'HASH_BUDGET_MB', 'DECISION_TTL_HOURS',
+)
+
+class _Stat:
+    """The stat fields the pipeline reads, rebuilt from a snapshot row."""
+    __slots__ = ('st_dev', 'st_ino', 'st_nlink', 'st_size', 'st_mtime_ns', 'st_mtime')
+    def __init__(self, dev, ino, nlink, size, mtime_ns):
+        self.st_dev, self.st_ino, self.st_nlink, self.st_size = dev, ino, nlink, size
+        self.st_mtime_ns, self.st_mtime = mtime_ns, mtime_ns / 1e9
+
+def _stat_row(st):
+    return [st.st_dev, st.st_ino, st.st_nlink, st.st_size, st.st_mtime_ns]
+
+def _replay_stat(row, path):
+    if isinstance(row, int):
+        raise OSError(row, os.strerror(row), path)
+    return _Stat(*row)
+
+class _Listing(list):
+    """scandir() result served from a list; usable as a context manager like the real iterator."""
+    def __enter__(self):
+        return iter(self)
+    def __exit__(self, *exc):
         return False
+
+class _RecordingEntry:
+    """Wraps a DirEntry; d_type/d_ino answers are recorded up front, stat() when called."""
+    __slots__ = ('entry', 'row', 'name', 'path')
+    def __init__(self, entry, rows):
+        self.entry, self.name, self.path = entry, entry.name, entry.path
+        self.row = {'name': entry.name, 'dir': entry.is_dir(), 'ldir': entry.is_dir(follow_symlinks=False),
+                    'link': entry.is_symlink(), 'file': entry.is_file(follow_symlinks=False), 'ino': entry.inode()}
+        rows.append(self.row)
+    def is_dir(self, follow_symlinks=True):
+        return self.row['dir'] if follow_symlinks else self.row['ldir']
+    def is_file(self, follow_symlinks=True):
+        return self.entry.is_file(follow_symlinks=follow_symlinks)
+    def is_symlink(self):
+        return self.row['link']
+    def inode(self):
+        return self.row['ino']
+    def stat(self):
+        try:
+            st = self.entry.stat()
+        except OSError as e:
+            self.row['stat'] = e.errno
+            raise
+        self.row['stat'] = _stat_row(st)
+        return st
+
+class _ReplayEntry:
+    __slots__ = ('row', 'name', 'path')
+    def __init__(self, parent, row):
+        self.row, self.name, self.path = row, row['name'], os.path.join(parent, row['name'])
+    def is_dir(self, follow_symlinks=True):
+        return self.row['dir'] if follow_symlinks else self.row['ldir']
+    def is_file(self, follow_symlinks=True):
+        return self.row['file']  # recorded without following symlinks, as the pipeline asks
+    def is_symlink(self):
+        return self.row['link']
+    def inode(self):
+        return self.row['ino']
+    def stat(self):
+        return _replay_stat(self.row.get('stat', errno.ENOENT), self.path)
+
+class _SnapshotPath:
+    def __init__(self, shim):
+        self._shim = shim
+    def __getattr__(self, name):
+        return getattr(os.path, name)
+    def isdir(self, p):
+        return self._shim._flag('isdir', p, p, lambda: os.path.isdir(p))
+
+class _SnapshotOS:
+    """
+    Stands in for `os` in this module while a snapshot is recorded or replayed:
+    stat, scandir, isdir and access on paths under MEDIA_DIRS and every
+    instance's downloads root are captured (record) or answered from the
+    snapshot (replay). Everything else, the cache directory included, goes to
+    the real os module.
+    """
+    def __init__(self, data, replay):
+        self.data, self.replay = data, replay
+        self.roots = tuple(r.rstrip(os.sep) for r in MEDIA_DIRS + [i.downloads_dir for i in get_instances()])
+        self.path = _SnapshotPath(self)
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(os, name)
+
+    def _ours(self, p):
+        return any(p == r or p.startswith(r + os.sep) for r in self.roots)
+
+    def _flag(self, kind, key, p, real):
+        if not self._ours(p):
+            return real()
+        if self.replay:
+            if key not in self.data[kind]:
+                self.misses += 1
+            return self.data[kind].get(key, False)
+        self.data[kind][key] = value = real()
+        return value
+
+    def access(self, p, mode):
+        return self._flag('access', f"{mode}:{p}", p, lambda: os.access(p, mode))
+
+    def stat(self, p):
+        if not self._ours(p):
+            return os.stat(p)
+        table = self.data['stat']
+        if self.replay:
+            if p not in table:
+                self.misses += 1
+            return _replay_stat(table.get(p, errno.ENOENT), p)
+        try:
+            st = os.stat(p)
+        except OSError as e:
+            table[p] = e.errno
+            raise
+        table[p] = _stat_row(st)
+        return st
+
+    def scandir(self, p):
+        if not self._ours(p):
+            return os.scandir(p)
+        table = self.data['scandir']
+        if self.replay:
+            rows = table.get(p)
+            if rows is None:
+                self.misses += 1
+                rows = errno.ENOENT
+            if isinstance(rows, int):
+                raise OSError(rows, os.strerror(rows), p)
+            return _Listing(_ReplayEntry(p, row) for row in rows)
+        try:
+            with os.scandir(p) as it:
+                entries = list(it)
+        except OSError as e:
+            table[p] = e.errno
+            raise
+        rows = table[p] = []
+        return _Listing(_RecordingEntry(entry, rows) for entry in entries)
+
+class _ShiftedTime:
+    """`time` with the wall clock moved back to when the snapshot was recorded, so ages and TTLs match."""
+    def __init__(self, offset):
+        self.offset = offset
+    def __getattr__(self, name):
+        return getattr(time, name)
+    def time(self):
+        return time.time() + self.offset
+    def time_ns(self):
+        return time.time_ns() + int(self.offset * 1e9)
+
+def _api_key(method, url, kwargs):
+    args = dict(kwargs.get('params') or {})
+    args.update(kwargs.get('data') or {})
+    args.pop('username', None)
+    args.pop('password', None)
+    return f"{method.upper()} {url.split('/api/v2/', 1)[-1]} {json.dumps(args, sort_keys=True)}"
+
+class _RecordingSession:
+    _lock = threading.Lock()  # instances record into the same list
+
+    def __init__(self, session, data, instance):
+        self.session, self.data, self.instance = session, data, instance
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+    def request(self, method, url, **kwargs):
+        r = self.session.request(method, url, **kwargs)
+        with self._lock:
+            self.data['api'].append([_api_key(method, url, kwargs), r.status_code, r.text, self.instance])
+        return r
+
+class _ReplayResponse:
+    def __init__(self, status_code, text):
+        self.status_code, self.text = status_code, text
+    def json(self):
+        return json.loads(self.text)
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} (replayed)")
+
+class _ReplaySession:
+    """Answers one instance's Web API requests with its recorded responses, in recorded order per request."""
+    def __init__(self, data, instance=''):
+        self.responses = defaultdict(deque)
+        for key, status, text, *rest in data['api']:
+            if (rest[0] if rest else '') == instance:
+                self.responses[key].append((status, text))
+        self.lock = threading.Lock()
+        self.misses = 0
+    def request(self, method, url, **kwargs):
+        with self.lock:
+            queue = self.responses.get(_api_key(method, url, kwargs))
+            if not queue:
+                self.misses += 1
+                return _ReplayResponse(404, '')
+            status, text = queue.popleft() if len(queue) > 1 else queue[0]
+        return _ReplayResponse(status, text)
+    def close(self):
+        pass
+
+def record_snapshot(fn):
+    """
+    Run fn (one cycle) while capturing everything it reads from outside: every
+    instance's Web API responses, stat/scandir results under MEDIA_DIRS and the
+    downloads roots, and quickhashes. Saved with a copy of cache.db from before
+    the cycle as CACHE_DIR/snapshots/cycle-<time>.tar.gz for replay_snapshot().
+    """
+    out_dir = os.path.join(CACHE_DIR, 'snapshots')
+    if not _ensure_dir(out_dir):
+        log(f"⚠ snapshot directory {out_dir} is not writable; running the cycle without recording.")
+        return fn()
+    state = get_state()
+    instances = state.instances
+    data = {'version': SNAPSHOT_VERSION, 'recorded': time.time(), 'config': {k: globals()[k] for k in _SNAPSHOT_CONFIG},
+            'instances': [{'name': i.name, 'downloads_dir': i.downloads_dir, 'orphan_tag': i.orphan_tag,
+                           'tag_prefix': i.tag_prefix} for i in instances],
+            'api': [], 'stat': {}, 'scandir': {}, 'isdir': {}, 'access': {}, 'qhash': {}}
+    work = tempfile.mkdtemp(dir=out_dir)
+    db = os.path.join(CACHE_DIR, 'cache.db')
+    if os.path.exists(db):
+        src, dst = sqlite3.connect(db), sqlite3.connect(os.path.join(work, 'cache.db'))
+        try:
+            src.backup(dst)
+        finally:
+            src.close()
+            dst.close()
+
+    sessions = []
+    for inst in instances:
+        if inst.client is None:
+            inst.client = QbClient(inst.url, inst.user, inst.password)
+        sessions.append(inst.client.session)
+        inst.client.session = _RecordingSession(inst.client.session, data, inst.name)
+    host = state.host
+    def recording_hash(path, budget, block=1024*1024):
+        digest = host.quick_hash(path, budget, block)
+        try:
+            st = os.stat(path)
+            data['qhash'][path] = [digest, st.st_size, st.st_dev]
+        except OSError:
+            pass
+        return digest
+    state.host = Host(_SnapshotOS(data, replay=False), host.clock, recording_hash)
+    try:
+        return fn()
+    finally:
+        state.host = host
+        for inst, session in zip(instances, sessions):
+            inst.client.session = session
+        path = os.path.join(out_dir, f"cycle-{datetime.fromtimestamp(data['recorded']).strftime('%Y%m%d-%H%M%S')}.tar.gz")
+        try:
+            with open(os.path.join(work, 'snapshot.json'), 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            with tarfile.open(path, 'w:gz') as tar:
+                for name in sorted(os.listdir(work)):
+                    tar.add(os.path.join(work, name), arcname=name)
+            log(f"📼 Snapshot written to {path}: {len(data['api'])} API responses, {len(data['stat'])} stats, "
+                f"{len(data['scandir'])} listings, {len(data['qhash'])} quickhashes.")
+        except OSError as e:
+            log(f"⚠ snapshot write failed: {e}")
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+def replay_snapshot(path):
+    """
+    Run one full cycle against a snapshot, with no qBittorrent and no library.
+    The recorded config and clock are restored; the cache.db copy, action log
+    and PROFILE output go to <snapshot>.replay/, so a snapshot replays the same
+    way every time. The daemon's own state, config and action log are put back
+    afterwards, so several snapshots can be replayed in one process.
+    """
+    global _INSTANCES, _STATE, ACTION_LOG, CACHE_DIR, ACTION_LOG_PATH, MEDIA_WATCH, LOAD_AWARE
+    work = (path[:-len('.tar.gz')] if path.endswith('.tar.gz') else path) + '.replay'
+    os.makedirs(work, exist_ok=True)
+    for name in ('cache.db', 'cache.db-wal', 'cache.db-shm', 'actions.log', 'actions.log.idx'):
+        try:
+            os.remove(os.path.join(work, name))
+        except FileNotFoundError:
+            pass
+    with tarfile.open(path, 'r:gz') as tar:
+        data = json.load(tar.extractfile('snapshot.json'))
+        if 'cache.db' in tar.getnames():
+            with open(os.path.join(work, 'cache.db'), 'wb') as f:
+                shutil.copyfileobj(tar.extractfile('cache.db'), f)
+    if data.get('version') != SNAPSHOT_VERSION:
+        raise SystemExit(f"{path}: snapshot version {data.get('version')} is not supported.")
+
+    saved = {k: globals()[k] for k in _SNAPSHOT_CONFIG + (
+        'CACHE_DIR', 'ACTION_LOG_PATH', 'MEDIA_WATCH', 'LOAD_AWARE', '_INSTANCES', '_STATE', 'ACTION_LOG')}
+    globals().update(data['config'])
+    CACHE_DIR, ACTION_LOG_PATH = work, os.path.join(work, 'actions.log')
+    MEDIA_WATCH = LOAD_AWARE = False
+    ACTION_LOG = ActionLog()
+    _INSTANCES, sessions = [], []
+    for spec in data.get('instances') or [{'name': ''}]:
+        inst = Instance(spec['name'], 'http://snapshot.invalid', 'replay', 'replay',
+                        spec.get('downloads_dir'), spec.get('orphan_tag'), spec.get('tag_prefix'))
+        inst.client = QbClient(inst.url, inst.user, inst.password)
+        inst.client.session = _ReplaySession(data, inst.name)
+        sessions.append(inst.client.session)
+        _INSTANCES.append(inst)
+    hashes = data['qhash']
+    def replay_hash(path, budget, block=1024*1024):
+        if path not in hashes:
+            return None
+        digest, size, dev = hashes[path]
+        if not budget.need(_qhash_cost(size, block), dev):
+            return None
+        METRICS.inc('qbit_tagger_hashed_bytes_total', _qhash_cost(size, block))
+        return digest
+    shim = _SnapshotOS(data, replay=True)
+
+    log(f"▶ Replaying {path} (recorded {datetime.fromtimestamp(data['recorded']).isoformat(sep=' ', timespec='seconds')}); "
+        f"work files in {work}.")
     try:
-        r = s.post(f"{QBITTORRENT_URL}/api/v2/{path}", data=data, timeout=15)
+        _STATE = DaemonState(Host(shim, _ShiftedTime(data['recorded'] - time.time()), replay_hash))
+        run_profiled(run_cleanup)
+    finally:
+        try:
+            if _STATE is not None:
+                _STATE.close()
+            ACTION_LOG.close()
+        finally:
+            globals().update(saved)
+    api_misses = sum(session.misses for session in sessions)
+    if shim.misses or api_misses:
+        log(f"⚠ Replay left the recording: {shim.misses} filesystem and {api_misses} API lookup(s) were not in the snapshot.")
+
+# =========================
+# qBittorrent helpers
+# =========================
+class QbClient:
+    """
+    Minimal qBittorrent Web API client on one long-lived keep-alive session.
+    Logs in once, re-authenticates once on 403 and bounds the connection pool,
+    so reads and tag writes share connections across cycles.
+    """
+    def __init__(self, url, username, password, pool_size=QB_POOL_SIZE, timeout=QB_TIMEOUT):
+        self.url = url
+        self.api = f"{url}/api/v2/"
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({'Referer': f"{url}/", 'Origin': url})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._auth_lock = threading.Lock()
+        self._auth_gen = 0  # bumped on every successful login
+        self.authenticated = False
+
+    def login(self, seen_gen=None):
+        with self._auth_lock:
+            # another thread already re-authenticated after our 403
+            if seen_gen is not None and self._auth_gen != seen_gen and self.authenticated:
+                return
+            r = self._timed('post', 'auth/login',
+                            data={'username': self.username, 'password': self.password},
+                            timeout=10)
+            if r.status_code != 200 or r.text.strip() != 'Ok.':
+                self.authenticated = False
+                raise RuntimeError(f"auth failed: {r.status_code} {r.text.strip()}")
+            self._auth_gen += 1
+            self.authenticated = True
+
+    def request(self, method, path, **kwargs):
+        if not self.authenticated:
+            self.login()
+        kwargs.setdefault('timeout', self.timeout)
+        gen = self._auth_gen
+        r = self._timed(method, path, **kwargs)
+        if r.status_code == 403:
+            # session cookie expired or qBittorrent restarted
+            self.login(seen_gen=gen)
+            r = self._timed(method, path, **kwargs)
+        return r
+
+    def _timed(self, method, path, **kwargs):
+        start = time.monotonic()
+        try:
+            r = self.session.request(method, self.api + path, **kwargs)
+        except Exception:
+            METRICS.inc('qbit_tagger_api_requests_total', endpoint=path, status='error')
+            raise
+        METRICS.observe('qbit_tagger_api_request_seconds', time.monotonic() - start, endpoint=path)
+        METRICS.inc('qbit_tagger_api_requests_total', endpoint=path, status=str(r.status_code))
+        return r
+
+    def get_json(self, path, params=None):
+        r = self.request('get', path, params=params)
+        r.raise_for_status()
+        return r.json() if r.text else {}
+
+    def torrents(self, **filters):
+        return self.get_json('torrents/info', params=filters or None)
+
+    def get_torrent_files(self, infohash):
+        return self.get_json('torrents/files', params={'hash': infohash.lower()})
+
+class Instance:
+    """
+    One qBittorrent instance: its client, downloads root and tag names, plus
+    what the daemon keeps for it between cycles (torrent table, file listings,
+    decisions). The media walk and link index are shared by all instances.
+    """
+    def __init__(self, name, url, user, password, downloads_dir=None, orphan_tag=None, tag_prefix=None):
+        self.name = name
+        self.url = url.rstrip('/')
+        self.user = user
+        self.password = password
+        self.downloads_dir = downloads_dir or DOWNLOADS_DIR
+        self.orphan_tag = orphan_tag or ORPHAN_TAG
+        self.tag_prefix = tag_prefix or MEDIA_LINK_TAG_PREFIX
+        self.client = None   # survives across cycles
+        self.table = TorrentTable()
+        self.files_cache = {}
+        self.tstate = None   # loaded by DaemonState
+
+    @property
+    def labels(self):
+        """Metric labels; empty for the single unnamed instance so its series keep their names."""
+        return {'instance': self.name} if self.name else {}
+
+    def connect(self):
+        try:
+            if self.client is None:
+                self.client = QbClient(self.url, self.user, self.password)
+            if not self.client.authenticated:
+                self.client.login()
+            return self.client
+        except Exception as e:
+            log(f"Error connecting to qBittorrent at {self.url}: {e}")
+            return None
+
+    def logging(self):
+        """Context manager prefixing this thread's log lines with the instance name."""
+        return _InstanceLog(self.name)
+
+class _InstanceLog:
+    def __init__(self, name):
+        self.prefix = f"[{name}] " if name else ''
+    def __enter__(self):
+        self.saved = getattr(_LOG_CTX, 'prefix', '')
+        _LOG_CTX.prefix = self.prefix
+    def __exit__(self, *exc):
+        _LOG_CTX.prefix = self.saved
+        return False
+
+def load_instances():
+    """Instances from QB_INSTANCES, or the single unnamed instance from QBITTORRENT_URL/USER/PASS."""
+    if not QB_INSTANCES:
+        if not all([QBITTORRENT_URL, QBITTORRENT_USER, QBITTORRENT_PASS]):
+            raise SystemExit("Missing qBittorrent env vars.")
+        return [Instance('', QBITTORRENT_URL, QBITTORRENT_USER, QBITTORRENT_PASS)]
+    try:
+        raw = QB_INSTANCES
+        if not raw.startswith('['):
+            with open(raw) as f:
+                raw = f.read()
+        specs = json.loads(raw)
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"QB_INSTANCES: {e}")
+    instances = []
+    for spec in specs if isinstance(specs, list) else []:
+        if not isinstance(spec, dict):
+            raise SystemExit(f"QB_INSTANCES: expected an object per instance, got {json.dumps(spec)}.")
+        name = str(spec.get('name') or '').strip()
+        user, password = spec.get('user', QBITTORRENT_USER), spec.get('pass', QBITTORRENT_PASS)
+        if not (name and spec.get('url') and user and password):
+            raise SystemExit(f"QB_INSTANCES: every instance needs name, url, user and pass ({json.dumps(name or spec.get('url'))}).")
+        if any(i.name == name for i in instances):
+            raise SystemExit(f"QB_INSTANCES: duplicate instance name {name!r}.")
+        instances.append(Instance(name, spec['url'], user, password,
+                                  spec.get('downloads_dir'), spec.get('orphan_tag'), spec.get('tag_prefix')))
+    if not instances:
+        raise SystemExit("QB_INSTANCES: expected a non-empty JSON list of instances.")
+    return instances
+
+_INSTANCES = None  # loaded on the first cycle
+
+def get_instances():
+    global _INSTANCES
+    if _INSTANCES is None:
+        _INSTANCES = load_instances()
+    return _INSTANCES
+
+def _api_post(qb, path, data):
+    try:
+        r = qb.request('post', path, data=data)
         if r.status_code == 200:
             log(f"➡ POST {path} 200 OK")
             return True
@@ -153,14 +1069,14 @@ def _api_post(path, data):
         log(f"❌ POST {path} exception: {e}")
         return False
 
-def add_tag_http(hashes, tag):
-    if hashes and _api_post('torrents/addTags', {'hashes': '|'.join(hashes), 'tags': tag}):
+def add_tag_http(qb, hashes, tag):
+    if hashes and _api_post(qb, 'torrents/addTags', {'hashes': '|'.join(hashes), 'tags': tag}):
         log(f"✅ addTags OK: tagged {len(hashes)} torrent(s) with '{tag}'.")
         return len(hashes)
     return 0
 
-def remove_tag_http(hashes, tag):
-    if hashes and _api_post('torrents/removeTags', {'hashes': '|'.join(hashes), 'tags': tag}):
+def remove_tag_http(qb, hashes, tag):
+    if hashes and _api_post(qb, 'torrents/removeTags', {'hashes': '|'.join(hashes), 'tags': tag}):
         log(f"🗑 removeTags OK: removed '{tag}' from {len(hashes)} torrent(s).")
         return len(hashes)
     return 0
@@ -168,15 +1084,18 @@ def remove_tag_http(hashes, tag):
 # =========================
 # Activity gates
 # =========================
+def _tag_set(t):
+    # qBittorrent joins tags with ", "
+    return {tag.strip() for tag in (t.get('tags') or '').split(',') if tag.strip()}
+
 def is_actively_seeding(t):
     # Strict: only these are "active"
     s = (t.get('state') or '').strip().lower()
     return s in {'uploading', 'forcedup', 'checkingup', 'queuedup'}
 
-def is_recently_active(t, minutes):
+def is_recently_active(t, minutes, now):
     if minutes <= 0:
         return False
-    now = int(time.time())
     la = t.get('last_activity')
     if isinstance(la, int) and la > 0 and (now - la) < minutes * 60:
         return True
@@ -186,45 +1105,70 @@ def is_recently_active(t, minutes):
         return True
     return False
 
-def is_too_new(t, hours):
+def is_too_new(t, hours, now):
     if hours <= 0:
         return False
     co = t.get('completion_on')
     if not isinstance(co, int) or co <= 0:
         return True
-    return (int(time.time()) - co) < hours * 3600
+    return (now - co) < hours * 3600
 
 # =========================
 # Filesystem helpers
 # =========================
+class Host:
+    """
+    What a cycle reads from outside the process: the filesystem (`fs`, os-like:
+    stat, scandir, access, path.isdir), the wall clock (`clock`, time-like: time,
+    time_ns) and file quickhashes. DaemonState hands it down the pipeline, so a
+    snapshot can stand in for one cycle without touching the os and time modules.
+    """
+    def __init__(self, fs=os, clock=time, quick_hash=None):
+        self.fs = fs
+        self.clock = clock
+        self._quick_hash = quick_hash
+
+    def now(self):
+        return int(self.clock.time())
+
+    def quick_hash(self, path, budget, block=1024*1024):
+        return (self._quick_hash or quick_hash_budgeted)(path, budget, block)
+
+HOST = Host()  # the real filesystem, clock and reads
+
+def _media_ext_ok(path):
+    ext = os.path.splitext(path)[1].lower()
+    return (ext in EXT_WHITELIST) if EXT_WHITELIST else True
+
 def is_media_candidate(path, size_bytes):
     if size_bytes < MIN_SIZE_MB * 1024 * 1024:
         return False
-    ext = os.path.splitext(path)[1].lower()
-    return (ext in EXT_WHITELIST) if EXT_WHITELIST else True
+    return _media_ext_ok(path)
 
-def _dir_accessible(p):
+def _dir_accessible(p, fs):
     try:
-        if not os.path.isdir(p): return False
-        if not (os.access(p, os.R_OK) and os.access(p, os.X_OK)): return False
-        with os.scandir(p) as it:
+        if not fs.path.isdir(p): return False
+        if not (fs.access(p, os.R_OK) and fs.access(p, os.X_OK)): return False
+        with fs.scandir(p) as it:
             for _ in it: break
         return True
     except Exception:
         return False
 
-def _dir_fingerprint(path, entry_count=None):
-    try:
-        st = os.stat(path)
-        if entry_count is None:
-            with os.scandir(path) as it:
-                entry_count = sum(1 for _ in it)
-        return max(int(st.st_mtime), int(st.st_ino), int(entry_count or 0))
-    except Exception:
+# stamp: "dev:ino:mtime_ns", or None when the listing was read too close to its
+# last change to be trusted; nfiles: files directly inside; subdirs: child dir
+# names; tree: sha1 over stamp, nfiles and the children's trees (bottom-up)
+DirNode = namedtuple('DirNode', 'stamp nfiles subdirs tree')
+
+_RACY_NS = 2 * 10**9  # a directory changed this recently may change again within the same mtime tick
+
+def _dir_stamp(st, clock):
+    if clock.time_ns() - st.st_mtime_ns < _RACY_NS:
         return None
+    return f"{st.st_dev}:{st.st_ino}:{st.st_mtime_ns}"
 
 # =========================
-# JSON cache helpers
+# Cache store (SQLite, WAL)
 # =========================
 def _ensure_dir(p):
     try:
@@ -240,65 +1184,930 @@ def _load_json(path, default):
     except Exception:
         return default
 
-def _atomic_save_json(path, data):
-    tmp = f"{path}.tmp"
-    with open(tmp, 'w') as f:
-        json.dump(data, f, separators=(',', ':'), ensure_ascii=False)
-    os.replace(tmp, path)
+STORE_SCHEMA = 3
+_SQL_CHUNK = 500  # bound variables per IN (...) query
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS media_files (
+    dir TEXT NOT NULL, name TEXT NOT NULL,
+    size INTEGER, mtime INTEGER, dev INTEGER, ino INTEGER, qhash TEXT,
+    PRIMARY KEY (dir, name));
+CREATE INDEX IF NOT EXISTS media_files_size ON media_files (size);
+CREATE INDEX IF NOT EXISTS media_files_inode ON media_files (dev, ino);
+CREATE TABLE IF NOT EXISTS dir_fingerprints (
+    dir TEXT PRIMARY KEY, stamp TEXT, nfiles INTEGER, subdirs TEXT, tree TEXT);
+CREATE TABLE IF NOT EXISTS inode_hashes (
+    dev INTEGER NOT NULL, ino INTEGER NOT NULL,
+    size INTEGER, mtime INTEGER, qhash TEXT, used INTEGER,
+    PRIMARY KEY (dev, ino));
+CREATE TABLE IF NOT EXISTS torrent_state (
+    instance TEXT NOT NULL DEFAULT '', hash TEXT NOT NULL, completion_on INTEGER, save_path TEXT,
+    decision TEXT, decided_at INTEGER, coverage_pct INTEGER, coverage_tag TEXT,
+    PRIMARY KEY (instance, hash));
+"""
+
+_TORRENT_STATE_COLS = ('completion_on', 'save_path', 'decision', 'decided_at', 'coverage_pct', 'coverage_tag')
+
+class CacheStore:
+    """
+    Persistent state in CACHE_DIR/cache.db: the media index, directory
+    fingerprints, inode quickhashes and per-torrent decisions (by instance). Changes are
+    written as row-level upserts/deletes; DaemonState decides when to commit.
+    Falls back to an in-memory database when CACHE_DIR is not writable.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        try:
+            self.conn = sqlite3.connect(path or ':memory:', check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+        except Exception as e:
+            log(f"⚠ cache store unavailable at {path} ({e}); using an in-memory cache.")
+            self.path = None
+            self.conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(_SCHEMA)
+        schema = self.get_meta('schema')
+        if schema is None:
+            self.set_meta('schema', STORE_SCHEMA)
+            self._migrate_json()
+        elif schema < STORE_SCHEMA:
+            if schema < 2:
+                # v1 fingerprints were max(mtime, ino, count); the next walk rebuilds them
+                self.conn.executescript("DROP TABLE dir_fingerprints;" + _SCHEMA)
+            # v3 keys decisions by (instance, hash); existing ones belong to the unnamed instance
+            cols = ', '.join(_TORRENT_STATE_COLS)
+            self.conn.executescript(f"ALTER TABLE torrent_state RENAME TO torrent_state_v2;{_SCHEMA}"
+                                    f"INSERT INTO torrent_state (instance, hash, {cols}) "
+                                    f"SELECT '', hash, {cols} FROM torrent_state_v2;"
+                                    "DROP TABLE torrent_state_v2;")
+            self.set_meta('schema', STORE_SCHEMA)
+        self.commit()
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def pending(self):
+        """True while there are uncommitted changes."""
+        with self.lock:
+            return self.conn.in_transaction
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            if self.path:
+                self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            self.conn.close()
+
+    # --- meta
+    def get_meta(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    # --- media index
+    def dir_fingerprints(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT dir, stamp, nfiles, subdirs, tree FROM dir_fingerprints").fetchall()
+        return {d: DirNode(stamp, nfiles, tuple(json.loads(subdirs)), tree) for d, stamp, nfiles, subdirs, tree in rows}
+
+    def apply_media_walk(self, walk):
+        """
+        Fold a MediaWalk into media_files: changed directories are diffed row by
+        row, directories the walk no longer reaches are dropped. Updates
+        walk.known_fingerprints in place to match. Returns rows removed.
+        """
+        known = walk.known_fingerprints
+        if walk.unchanged():
+            return 0
+        removed = 0
+        live = set(walk.fingerprints) | walk.unreadable
+        with self.lock:
+            c = self.conn
+            for d, files in walk.dir_files.items():
+                old = {name: (size, mtime, ino, dev) for name, size, mtime, ino, dev in
+                       c.execute("SELECT name, size, mtime, ino, dev FROM media_files WHERE dir=?", (d,))}
+                gone = [(d, name) for name in old if name not in files]
+                if gone:
+                    c.executemany("DELETE FROM media_files WHERE dir=? AND name=?", gone)
+                    removed += len(gone)
+                c.executemany(
+                    "INSERT OR REPLACE INTO media_files (dir, name, size, mtime, dev, ino, qhash) "
+                    "VALUES (?, ?, ?, ?, ?, ?, NULL)",
+                    [(d, name, size, mtime, dev, ino) for name, (size, mtime, ino, dev) in files.items()
+                     if old.get(name) != (size, mtime, ino, dev)])
+            for (d,) in c.execute("SELECT DISTINCT dir FROM media_files").fetchall():
+                if d not in live:
+                    removed += c.execute("DELETE FROM media_files WHERE dir=?", (d,)).rowcount
+            c.executemany("INSERT OR REPLACE INTO dir_fingerprints (dir, stamp, nfiles, subdirs, tree) "
+                          "VALUES (?, ?, ?, ?, ?)",
+                          [(d, n.stamp, n.nfiles, json.dumps(n.subdirs), n.tree)
+                           for d, n in walk.fingerprints.items() if known.get(d) != n])
+            c.executemany("DELETE FROM dir_fingerprints WHERE dir=?",
+                          [(d,) for d in known if d not in live])
+        # keep the caller's resident copy in step with the table
+        for d in [d for d in known if d not in live]:
+            del known[d]
+        known.update(walk.fingerprints)
+        return removed
+
+    def media_by_sizes(self, sizes):
+        """Yields (dir, name, size, mtime, dev, ino, qhash) for media files of the given sizes."""
+        sizes = list(sizes)
+        for i in range(0, len(sizes), _SQL_CHUNK):
+            chunk = sizes[i:i + _SQL_CHUNK]
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT dir, name, size, mtime, dev, ino, qhash FROM media_files "
+                    f"WHERE size IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+            yield from rows
+
+    def set_media_qhash(self, d, name, qhash):
+        with self.lock:
+            self.conn.execute("UPDATE media_files SET qhash=? WHERE dir=? AND name=?", (qhash, d, name))
+
+    def media_count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM media_files").fetchone()[0]
+
+    # --- inode quickhashes
+    def get_inode_hash(self, dev, ino):
+        with self.lock:
+            return self.conn.execute("SELECT size, mtime, qhash, used FROM inode_hashes WHERE dev=? AND ino=?",
+                                     (dev, ino)).fetchone()
+
+    def put_inode_hash(self, dev, ino, size, mtime, qhash, used):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO inode_hashes (dev, ino, size, mtime, qhash, used) "
+                              "VALUES (?, ?, ?, ?, ?, ?)", (dev, ino, size, mtime, qhash, used))
+
+    def touch_inode_hash(self, dev, ino, used):
+        with self.lock:
+            self.conn.execute("UPDATE inode_hashes SET used=? WHERE dev=? AND ino=?", (used, dev, ino))
+
+    def prune_inode_hashes(self, cutoff):
+        with self.lock:
+            return self.conn.execute("DELETE FROM inode_hashes WHERE used < ?", (cutoff,)).rowcount
+
+    # --- per-torrent decisions
+    def load_torrent_states(self, instance=''):
+        with self.lock:
+            rows = self.conn.execute(f"SELECT hash, {', '.join(_TORRENT_STATE_COLS)} FROM torrent_state "
+                                     "WHERE instance=?", (instance,)).fetchall()
+        return {row[0]: dict(zip(_TORRENT_STATE_COLS, row[1:])) for row in rows}
+
+    def save_torrent_states(self, entries, instance=''):
+        with self.lock:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO torrent_state (instance, hash, {', '.join(_TORRENT_STATE_COLS)}) "
+                f"VALUES (?, ?{', ?' * len(_TORRENT_STATE_COLS)})",
+                [(instance, h) + tuple(ent.get(k) for k in _TORRENT_STATE_COLS) for h, ent in entries.items()])
+
+    def clear_torrent_states(self):
+        with self.lock:
+            return self.conn.execute("DELETE FROM torrent_state").rowcount
+
+    # --- one-time import of the JSON caches used before cache.db
+    def _migrate_json(self):
+        if not self.path:
+            return
+        c = self.conn
+        migrated = []
+
+        media_path = os.path.join(CACHE_DIR, 'media_hashes.json')
+        raw = _load_json(media_path, None)
+        if isinstance(raw, dict):
+            entries = raw.get('entries') or {}
+            version = raw.get('version')
+            if version != 3:
+                # v1/v2 were flat {path: entry}
+                grouped = defaultdict(dict)
+                for path_key, ent in entries.items():
+                    grouped[os.path.dirname(path_key)][os.path.basename(path_key)] = ent
+                entries = grouped
+            c.executemany("INSERT OR REPLACE INTO media_files (dir, name, size, mtime, dev, ino, qhash) "
+                          "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                          [(d, name, e.get('size'), e.get('mtime'), e.get('dev'), e.get('ino'), e.get('qhash'))
+                           for d, files in entries.items() for name, e in files.items()])
+            # JSON fingerprints used the old scheme; the first walk re-stats every directory
+            migrated.append(media_path)
+
+        torrent_path = os.path.join(CACHE_DIR, 'torrent_state.json')
+        raw = _load_json(torrent_path, None)
+        if isinstance(raw, dict):
+            if 'entries' in raw:
+                self.set_meta('torrent_config', raw.get('config') or {})
+                raw = raw.get('entries') or {}
+            self.save_torrent_states({h: e for h, e in raw.items() if isinstance(e, dict)})
+            migrated.append(torrent_path)
+
+        inode_path = os.path.join(CACHE_DIR, 'inode_hashes.json')
+        raw = _load_json(inode_path, None)
+        if isinstance(raw, dict):
+            rows = []
+            for key, e in raw.items():
+                dev, _, ino = key.partition(':')
+                rows.append((int(dev), int(ino), e.get('size'), e.get('mtime'), e.get('qhash'), e.get('used')))
+            c.executemany("INSERT OR REPLACE INTO inode_hashes (dev, ino, size, mtime, qhash, used) "
+                          "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            migrated.append(inode_path)
+
+        self.commit()
+        for path in migrated:
+            try:
+                os.replace(path, f"{path}.migrated")
+            except OSError:
+                pass
+        if migrated:
+            log(f"ℹ️ Migrated {', '.join(os.path.basename(p) for p in migrated)} into {self.path}.")
 
 # =========================
 # Hash budget
 # =========================
+class TokenBucket:
+    """
+    Byte-rate limiter for hash reads, shared by every worker and kept across
+    cycles. Callers reserve tokens and sleep off any deficit, so reads come out
+    as a steady stream instead of a burst. With per_device each device gets its
+    own bucket at the full rate.
+    """
+    def __init__(self, rate_bytes, per_device=False):
+        self.rate = float(rate_bytes)
+        self.burst = max(self.rate, 2 * 1024 * 1024)  # one quickhash always fits
+        self.per_device = per_device
+        self.scale = 1.0  # set per cycle by the load monitor
+        self._buckets = {}  # dev or None -> [tokens, last refill]
+        self._lock = threading.Lock()
+
+    def acquire(self, nbytes, dev=None, deadline=None):
+        """Wait for nbytes of tokens; False (nothing reserved) if that would pass deadline or on shutdown."""
+        key = dev if self.per_device else None
+        with self._lock:
+            now = time.monotonic()
+            b = self._buckets.setdefault(key, [self.burst, now])
+            rate = self.rate * self.scale
+            if rate <= 0:
+                return False
+            b[0] = min(self.burst, b[0] + (now - b[1]) * rate)
+            b[1] = now
+            wait = max(0.0, (nbytes - b[0]) / rate)
+            if deadline is not None and now + wait > deadline:
+                return False
+            b[0] -= nbytes
+        return not (wait and _STOP.wait(wait))
+
+_HASH_RATE = TokenBucket(HASH_RATE_MB * 1024 * 1024, HASH_RATE_PER_DEVICE) if HASH_RATE_MB > 0 else None
+
 class Budget:
-    def __init__(self, mib):
+    """
+    Per-cycle hashing allowance: at most `mib` MiB and, when set, nothing after
+    `deadline` (time.monotonic()), read by `workers` threads per device
+    (default HASH_WORKERS_PER_DEVICE). Reads are paced by _HASH_RATE when enabled.
+    """
+    def __init__(self, mib, deadline=None, workers=None):
         self.total = int(mib) * 1024 * 1024
         self.remaining = self.total
+        self.deadline = deadline
+        self.workers = max(1, HASH_WORKERS_PER_DEVICE if workers is None else workers)
         self.exhausted = False
-    def need(self, nbytes):
-        if self.remaining >= nbytes:
+        self._lock = threading.Lock()  # shared by concurrent hash workers
+
+    def need(self, nbytes, dev=None):
+        with self._lock:
+            if self.remaining < nbytes:
+                self.exhausted = True
+                return False
             self.remaining -= nbytes
-            return True
-        self.exhausted = True
-        return False
+        if _HASH_RATE and not _HASH_RATE.acquire(nbytes, dev, self.deadline):
+            with self._lock:
+                self.remaining += nbytes
+                self.exhausted = True
+            return False
+        return True
+
+    def available(self):
+        """Bytes this budget can still read: the MiB cap, or what the rate allows before the deadline."""
+        if _HASH_RATE and self.deadline is not None:
+            secs = max(0.0, self.deadline - time.monotonic())
+            return min(self.remaining, int(secs * _HASH_RATE.rate * _HASH_RATE.scale))
+        return self.remaining
+
+_FADVISE = hasattr(os, 'posix_fadvise')
+
+def _pread_full(fd, n, offset):
+    chunks = []
+    while n > 0:
+        data = os.pread(fd, n, offset)
+        if not data:
+            break
+        chunks.append(data)
+        n -= len(data); offset += len(data)
+    return b''.join(chunks)
+
+def _qhash_cost(size, block=1024*1024):
+    """Bytes quick_hash_budgeted reads (and charges) for a file of this size."""
+    return min(block, size) + (block if size > block else 0)
 
 def quick_hash_budgeted(path, budget, block=1024*1024):
+    """
+    sha1 of the first and last `block` bytes. Reads with pread, hints the kernel
+    to prefetch both ranges and drops them from the page cache afterwards so
+    hashing does not evict pages qBittorrent is seeding from.
+    """
     try:
-        sz = os.path.getsize(path)
-        need = min(block, sz) + (block if sz > block else 0)
-        if not budget.need(need):
+        fd = os.open(path, os.O_RDONLY)
+    except Exception:
+        return None
+    ranges = []
+    try:
+        st = os.fstat(fd)
+        sz = st.st_size
+        if not budget.need(_qhash_cost(sz, block), st.st_dev):
             return None
+        ranges.append((0, min(block, sz)))
+        if sz > block:
+            ranges.append((max(0, sz - block), block))
+        if _FADVISE:
+            for off, n in ranges:
+                os.posix_fadvise(fd, off, n, os.POSIX_FADV_WILLNEED)
         h = hashlib.sha1()
-        with open(path, 'rb') as f:
-            data = f.read(min(block, sz)); h.update(data)
-            if sz > block:
-                try: f.seek(max(0, sz - block))
-                except OSError: pass
-                data2 = f.read(block); h.update(data2)
+        for off, n in ranges:
+            h.update(_pread_full(fd, n, off))
+        METRICS.inc('qbit_tagger_hashed_bytes_total', sum(n for _, n in ranges))
         return h.hexdigest()
     except Exception:
         return None
+    finally:
+        if _FADVISE:
+            for off, n in ranges:
+                try: os.posix_fadvise(fd, off, n, os.POSIX_FADV_DONTNEED)
+                except OSError: pass
+        os.close(fd)
+
+def quick_hash_many(items, budget, host):
+    """
+    items: iterable of (key, path, dev). Returns {key: qhash or None}, read through host.
+    Each device gets its own pool of budget.workers threads so a slow array
+    never starves another; all workers draw from the same budget.
+    """
+    by_dev = defaultdict(list)
+    for key, path, dev in items:
+        by_dev[dev].append((key, path))
+    results = {}
+    if not by_dev:
+        return results
+    pools = [ThreadPoolExecutor(max_workers=min(budget.workers, len(files)))
+             for files in by_dev.values()]
+    try:
+        futures = []
+        for pool, files in zip(pools, by_dev.values()):
+            for key, path in files:
+                futures.append((key, pool.submit(host.quick_hash, path, budget)))
+        for key, fut in futures:
+            results[key] = fut.result()
+    finally:
+        for pool in pools:
+            pool.shutdown(wait=True)
+    return results
 
 # =========================
-# Stage 0: visibility guard
+# Load monitor (load-aware backoff)
 # =========================
-def build_media_visibility_stats():
-    files_count = 0
-    errors = 0
-    dirs_ok = 0
-    dirs_missing = []
+def _read_io_pressure():
+    """'some avg10' from /proc/pressure/io (percent of time tasks stalled on I/O), or None."""
+    try:
+        with open('/proc/pressure/io') as f:
+            for line in f:
+                if line.startswith('some'):
+                    return float(line.split('avg10=')[1].split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    return None
+
+def _read_disk_ticks():
+    """{disk: ms spent doing I/O} from /proc/diskstats, or None."""
+    ticks = {}
+    try:
+        with open('/proc/diskstats') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 13 or parts[2].startswith(('loop', 'ram', 'zram')):
+                    continue
+                ticks[parts[2]] = int(parts[12])
+    except (OSError, ValueError):
+        return None
+    return ticks
+
+class LoadMonitor:
+    """
+    Samples qBittorrent's global transfer rate (transfer/info) and local I/O
+    pressure once per cycle and turns them into a hashing scale:
+      1.0  below both thresholds (full budget, rate and workers; catches up)
+      0.25 busy (up to twice a threshold): a quarter of the budget and rate, one worker
+      0.0  saturated: no hashing and no periodic full media rescan this cycle
+    I/O load is PSI `some avg10` when the kernel exposes it, else the busiest
+    disk's utilisation since the previous sample.
+    """
+    def __init__(self):
+        self.ticks = None
+        self.ticks_at = None
+
+    def _disk_busy(self):
+        ticks, now = _read_disk_ticks(), time.monotonic()
+        busy = None
+        if ticks and self.ticks:
+            elapsed_ms = (now - self.ticks_at) * 1000
+            if elapsed_ms > 0:
+                busy = max((t - self.ticks.get(d, t)) / elapsed_ms * 100 for d, t in ticks.items())
+        self.ticks, self.ticks_at = ticks, now
+        return busy
+
+    def sample(self, clients):
+        """clients: the connected instances' clients; their transfer rates add up (shared disks)."""
+        transfer = None
+        for qb in clients:
+            try:
+                info = qb.get_json('transfer/info')
+            except Exception as e:
+                log(f"⚠ transfer/info failed at {qb.url} ({e}); judging load from the rest.")
+                continue
+            transfer = (transfer or 0) + ((info.get('up_info_speed') or 0) + (info.get('dl_info_speed') or 0)) / (1024 * 1024)
+        io_pct = _read_io_pressure()
+        io_src = 'psi'
+        disk = self._disk_busy()  # keep the diskstats baseline current either way
+        if io_pct is None:
+            io_pct, io_src = disk, 'disk'
+        load = 0.0
+        if transfer is not None and LOAD_TRANSFER_MB > 0:
+            load = max(load, transfer / LOAD_TRANSFER_MB)
+        if io_pct is not None and LOAD_IO_PERCENT > 0:
+            load = max(load, io_pct / LOAD_IO_PERCENT)
+        scale = 1.0 if load < 1 else (0.25 if load < 2 else 0.0)
+        log(f"🌡 Load: transfer={'n/a' if transfer is None else f'{transfer:.1f} MiB/s'}, "
+            f"io={'n/a' if io_pct is None else f'{io_pct:.1f}% ({io_src})'}, load={load:.2f} -> hashing at {int(scale * 100)}%.")
+        return scale
+
+# =========================
+# Inode quickhash cache (shared by media and torrent files)
+# =========================
+INODE_HASH_TTL_DAYS = 30  # forget inodes neither side has looked up for this long
+
+class InodeHashCache:
+    """
+    Quickhashes keyed by (dev, ino), valid while size and mtime still match.
+    Hardlinks share an inode, so a hash computed for a media file also serves
+    the torrent file it links to, and vice versa. Backed by the cache store.
+    """
+    def __init__(self, store, clock):
+        self.store = store
+        self.clock = clock
+        self.hits = 0
+
+    def get(self, dev, ino, size, mtime):
+        row = self.store.get_inode_hash(dev, ino)
+        if not row or row[0] != size or row[1] != mtime or not row[2]:
+            METRICS.inc('qbit_tagger_cache_lookups_total', cache='inode_hash', result='miss')
+            return None
+        r_size, r_mtime, qhash, used = row
+        today = int(self.clock.time() // 86400)
+        if used != today:
+            self.store.touch_inode_hash(dev, ino, today)
+        self.hits += 1
+        METRICS.inc('qbit_tagger_cache_lookups_total', cache='inode_hash', result='hit')
+        return qhash
+
+    def put(self, dev, ino, size, mtime, qhash):
+        self.store.put_inode_hash(dev, ino, size, mtime, qhash, int(self.clock.time() // 86400))
+
+    def prune(self):
+        return self.store.prune_inode_hashes(int(self.clock.time() // 86400) - INODE_HASH_TTL_DAYS)
+
+# =========================
+# Link index: exact inode matches, quickhash fallback
+# =========================
+class LinkIndex:
+    """
+    Resolves torrent files against the media library.
+    Files on a device that hosts a media dir are decided by (dev, ino) alone:
+    a hardlink can only live on the same filesystem, so no content is read.
+    Files on any other device fall back to (size, quickhash) signatures, which
+    are only trusted for sizes whose media side is fully hashed (complete_sizes).
+    A fallback file whose size no media file has is unlinked without any reads,
+    as is any file Stage 1 marked local_only.
+    """
+    def __init__(self, media_devs, hash_cache, host):
+        self.media_devs = set(media_devs)
+        self.hash_cache = hash_cache
+        self.host = host
+        self.inodes = set()
+        self.sigs = set()
+        self.sizes = set()  # sizes with at least one media file
+        self.complete_sizes = set()
+        self.sig_complete = True  # every fallback size is complete
+        self.torrent_qhashes = {}  # path -> qhash, filled by prehash()
+
+    def prehash(self, cand_files, budget):
+        """Hash every decidable fallback file up front and in parallel so resolve() does no I/O."""
+        todo = {}
+        for cf in cand_files:
+            if cf.get('local_only') or cf['dev'] in self.media_devs or cf['path'] in self.torrent_qhashes:
+                continue
+            if cf['size'] not in self.sizes:
+                continue  # no media file of this size: nothing to compare against
+            if cf['size'] not in self.complete_sizes:
+                continue  # undecidable this cycle; keep the budget for sizes that are
+            qh = self.hash_cache.get(cf['dev'], cf['ino'], cf['size'], cf['mtime'])
+            if qh:
+                self.torrent_qhashes[cf['path']] = qh
+            else:
+                todo[cf['path']] = cf
+        results = quick_hash_many(((p, p, cf['dev']) for p, cf in todo.items()), budget, self.host)
+        for p, qh in results.items():
+            self.torrent_qhashes[p] = qh
+            if qh:
+                cf = todo[p]
+                self.hash_cache.put(cf['dev'], cf['ino'], cf['size'], cf['mtime'], qh)
+
+    def resolve(self, cf, budget):
+        """True/False when decided, None when inconclusive."""
+        if cf.get('local_only'):
+            return False
+        if cf['dev'] in self.media_devs:
+            return (cf['dev'], cf['ino']) in self.inodes
+        if cf['size'] not in self.sizes:
+            return False
+        if cf['size'] not in self.complete_sizes:
+            return None
+        if cf['path'] in self.torrent_qhashes:
+            tqh = self.torrent_qhashes[cf['path']]
+        else:
+            tqh = self.host.quick_hash(cf['path'], budget)
+        if not tqh:
+            return None
+        return (cf['size'], tqh) in self.sigs
+
+# =========================
+# Media library walk (shared by Stage 0 and Stage 2)
+# =========================
+class MediaWalk:
+    def __init__(self):
+        self.files_count = 0
+        self.dirs_ok = 0
+        self.dirs_missing = []
+        self.errors = 0
+        self.roots = []          # media dirs reached
+        self.root_devs = set()
+        self.fingerprints = {}   # dir -> DirNode, every directory reached
+        self.dir_counts = {}     # dir -> number of files directly inside
+        self.dir_files = {}      # dir -> {name: (size, mtime, ino, dev)}, changed dirs only
+        self.unreadable = set()  # dirs that could not be listed; cached entries stay valid
+        self.known_fingerprints = {}
+        self.listed = 0          # directories read with scandir; the rest reused their stored listing
+        self.elapsed = 0.0
+
+    def unchanged(self):
+        """True when every root's tree hash matches the store: nothing below them changed."""
+        known = self.known_fingerprints
+        return (not self.dir_files and not self.unreadable and not self.dirs_missing and
+                len(known) == len(self.fingerprints) and
+                all(known.get(r) == self.fingerprints.get(r) for r in self.roots))
+
+def _scan_dir(walk, path, st, host, force=False):
+    """
+    List one directory into walk. A directory whose stamp (dev, ino, mtime_ns)
+    matches the store has the same entries as when it was recorded, so its file
+    count and child dirs are reused without a scandir; otherwise it is listed and
+    its media candidates are stat'ed. Returns [(subdir, stat)] to descend into.
+    """
+    fs = host.fs
+    stamp = _dir_stamp(st, host.clock)
+    old = walk.known_fingerprints.get(path)
+    if not force and stamp and old and old.stamp == stamp:
+        subdirs = []
+        for name in old.subdirs:
+            sub = os.path.join(path, name)
+            try:
+                subdirs.append((sub, fs.stat(sub)))
+            except OSError:
+                break  # listing moved on under the same mtime; read it properly
+        else:
+            walk.fingerprints[path] = old
+            walk.dir_counts[path] = old.nfiles
+            walk.files_count += old.nfiles
+            return subdirs
+    try:
+        with fs.scandir(path) as it:
+            listing = list(it)
+    except FileNotFoundError:
+        return []
+    except OSError:
+        walk.errors += 1
+        walk.unreadable.add(path)
+        return []
+    walk.listed += 1
+    changed = force or not stamp or not old or old.stamp != stamp
+    subdirs = []
+    files = {}
+    nfiles = 0
+    for entry in listing:
+        try:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirs.append((entry.path, entry.stat()))
+                continue
+        except OSError:
+            walk.errors += 1
+            continue
+        nfiles += 1
+        if not changed or not _media_ext_ok(entry.name):
+            continue
+        try:
+            fst = entry.stat()
+        except OSError:
+            walk.errors += 1
+            continue
+        if is_media_candidate(entry.name, fst.st_size):
+            files[entry.name] = (fst.st_size, int(fst.st_mtime), fst.st_ino, fst.st_dev)
+    walk.fingerprints[path] = DirNode(stamp, nfiles, tuple(sorted(os.path.basename(p) for p, _ in subdirs)), None)
+    walk.dir_counts[path] = nfiles
+    walk.files_count += nfiles
+    if changed:
+        walk.dir_files[path] = files
+    return subdirs
+
+def _walk_tree(walk, top, top_st, host, force=False, watcher=None):
+    stack = [(top, top_st)]
+    while stack:
+        path, st = stack.pop()
+        if watcher:
+            watcher.add_watch(path)  # before listing, so nothing slips between the two
+        stack.extend(_scan_dir(walk, path, st, host, force))
+
+def _roll_up(walk):
+    """
+    Fill in tree hashes bottom-up. A directory keeps its stored tree when its own
+    node and every child's tree are unchanged, so only the ancestors of a change
+    are rehashed.
+    """
+    known = walk.known_fingerprints
+    fps = walk.fingerprints
+    changed = set()
+    for d in sorted(fps, key=lambda p: p.count(os.sep), reverse=True):
+        node = fps[d]
+        kids = [os.path.join(d, name) for name in node.subdirs]
+        old = known.get(d)
+        if old and old.tree and old[:3] == node[:3] and not any(k in changed or k not in fps for k in kids):
+            if node.tree != old.tree:
+                fps[d] = old
+            continue
+        h = hashlib.sha1(f"{node.stamp}|{node.nfiles}".encode('utf-8', 'surrogateescape'))
+        for name, k in zip(node.subdirs, kids):
+            h.update(f"|{name}={fps[k].tree if k in fps else '?'}".encode('utf-8', 'surrogateescape'))
+        fps[d] = node._replace(tree=h.hexdigest())
+        changed.add(d)
+
+def walk_media_library(known_fingerprints, host, watcher=None):
+    """
+    One pass over MEDIA_DIRS: counts files for the visibility guard and
+    fingerprints every directory. Each directory costs one stat; only those
+    whose stamp differs from known_fingerprints are listed with scandir and have
+    their media candidates stat'ed (via DirEntry.stat).
+    """
+    walk = MediaWalk()
+    walk.known_fingerprints = known_fingerprints
     start = time.time()
     for media_dir in MEDIA_DIRS:
-        if not _dir_accessible(media_dir):
-            dirs_missing.append(media_dir)
+        if not _dir_accessible(media_dir, host.fs):
+            walk.dirs_missing.append(media_dir)
             continue
-        dirs_ok += 1
         try:
-            for _, _, files in os.walk(media_dir):
-                files_count += len(files)
+            root_st = host.fs.stat(media_dir)
         except Exception:
-            errors += 1
+            walk.dirs_missing.append(media_dir)
             continue
-    secs = time.time() - start
+        walk.dirs_ok += 1
+        walk.roots.append(media_dir)
+        walk.root_devs.add(root_st.st_dev)
+        _walk_tree(walk, media_dir, root_st, host, watcher=watcher)
+    _roll_up(walk)
+    walk.elapsed = time.time() - start
+    return walk
+
+# =========================
+# Media watcher (inotify, optional)
+# =========================
+IN_ATTRIB, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO = 0x4, 0x8, 0x40, 0x80
+IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_MOVE_SELF = 0x100, 0x200, 0x400, 0x800
+IN_UNMOUNT, IN_Q_OVERFLOW, IN_IGNORED = 0x2000, 0x4000, 0x8000
+IN_ONLYDIR, IN_ISDIR = 0x1000000, 0x40000000
+IN_NONBLOCK, IN_CLOEXEC = 0o4000, 0o2000000
+_IN_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+            IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+_IN_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+
+class MediaWatcher:
+    """
+    Keeps the media walk resident and, each cycle, rescans only directories that
+    received inotify events (or whose stored fingerprint is stale). A full walk
+    runs at startup, on event-queue overflow, when a media root is unmounted or
+    changes device, every MEDIA_WATCH_RESCAN_HOURS, and whenever watches cannot
+    be added; the tagger then keeps working with plain walks.
+    """
+    def __init__(self):
+        self.fd = None
+        self.libc = None
+        self.wd_dirs = {}
+        self.dir_wds = {}
+        self.dirty = set()       # dirs with events not yet folded into the store
+        self.removed = set()     # subtrees deleted or moved away since the last walk
+        self.need_full = True
+        self.disabled = False
+        self.base = None         # last MediaWalk; fingerprints and counts stay current
+        self.last_full = 0
+
+    def _open(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        self.fd = None
+        self.wd_dirs.clear()
+        self.dir_wds.clear()
+        if self.libc is None:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.fd = fd
+
+    def _disable(self, reason):
+        log(f"⚠ Media watcher disabled ({reason}); falling back to full walks.")
+        self.disabled = True
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def add_watch(self, path):
+        if self.fd is None or path in self.dir_wds:
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), _IN_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, 'inotify watch limit reached (fs.inotify.max_user_watches)')
+            return  # vanished or unreadable; the walk records it
+        self.wd_dirs[wd] = path
+        self.dir_wds[path] = wd
+
+    def _drain(self):
+        while True:
+            try:
+                buf = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return
+            off = 0
+            while off < len(buf):
+                wd, mask, _, nlen = _IN_EVENT.unpack_from(buf, off)
+                name = buf[off + _IN_EVENT.size: off + _IN_EVENT.size + nlen].split(b'\0', 1)[0]
+                off += _IN_EVENT.size + nlen
+                self._on_event(wd, mask, os.fsdecode(name))
+
+    def _on_event(self, wd, mask, name):
+        if mask & (IN_Q_OVERFLOW | IN_UNMOUNT):
+            self.need_full = True
+            return
+        d = self.wd_dirs.get(wd)
+        if d is None:
+            return
+        if mask & IN_IGNORED:
+            self.wd_dirs.pop(wd, None)
+            if self.dir_wds.get(d) == wd:
+                del self.dir_wds[d]
+            if d in MEDIA_DIRS:
+                self.need_full = True
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            if d in MEDIA_DIRS:
+                self.need_full = True
+            return
+        self.dirty.add(d)
+        if name and mask & IN_ISDIR and mask & (IN_DELETE | IN_MOVED_FROM):
+            self.removed.add(os.path.join(d, name))
+        elif name and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            self.dirty.add(os.path.join(d, name))
+
+    def _roots_changed(self, host):
+        base = self.base
+        devs = set()
+        ok = 0
+        for media_dir in MEDIA_DIRS:
+            if not _dir_accessible(media_dir, host.fs):
+                continue
+            try:
+                devs.add(host.fs.stat(media_dir).st_dev)
+            except Exception:
+                continue
+            ok += 1
+        return ok != base.dirs_ok or devs != base.root_devs
+
+    def walk(self, known_fingerprints, host, defer_rescan=False):
+        """defer_rescan postpones the periodic safety-net walk (not the required ones) while the box is busy."""
+        if self.disabled:
+            return walk_media_library(known_fingerprints, host)
+        try:
+            if self.fd is not None:
+                self._drain()
+            rescan_due = (MEDIA_WATCH_RESCAN_HOURS > 0 and not defer_rescan and
+                          time.time() - self.last_full > MEDIA_WATCH_RESCAN_HOURS * 3600)
+            if self.need_full or self.base is None or rescan_due or self._roots_changed(host):
+                return self._full(known_fingerprints, host)
+            return self._incremental(known_fingerprints, host)
+        except OSError as e:
+            self._disable(e)
+            return walk_media_library(known_fingerprints, host)
+
+    def _full(self, known_fingerprints, host):
+        self._open()
+        self.need_full = False
+        self.dirty.clear()
+        self.removed.clear()
+        # events raised during the walk stay queued and are rescanned next cycle
+        walk = walk_media_library(known_fingerprints, host, watcher=self)
+        self.base = walk
+        self.last_full = time.time()
+        log(f"👁 Media watcher: full walk, {len(self.dir_wds)} directories watched.")
+        return walk
+
+    def _incremental(self, known_fingerprints, host):
+        start = time.time()
+        base = self.base
+        walk = MediaWalk()
+        walk.known_fingerprints = known_fingerprints
+        walk.dirs_ok = base.dirs_ok
+        walk.roots = list(base.roots)
+        walk.dirs_missing = list(base.dirs_missing)
+        walk.root_devs = set(base.root_devs)
+        walk.fingerprints = dict(base.fingerprints)
+        walk.dir_counts = dict(base.dir_counts)
+        walk.unreadable = set(base.unreadable)
+
+        for top in self.removed:
+            prefix = top + os.sep
+            for d in [d for d in walk.fingerprints if d == top or d.startswith(prefix)]:
+                walk.fingerprints.pop(d, None)
+                walk.dir_counts.pop(d, None)
+                wd = self.dir_wds.pop(d, None)
+                if wd is not None:
+                    self.wd_dirs.pop(wd, None)
+                    self.libc.inotify_rm_watch(self.fd, wd)
+
+        # dirs with events, plus any the store has not caught up with (e.g. an aborted cycle)
+        rescan = {d for d in self.dirty if d in walk.fingerprints or d not in base.fingerprints}
+        rescan.update(d for d, fp in walk.fingerprints.items() if known_fingerprints.get(d) != fp)
+        rescan.update(walk.unreadable)
+        for d in rescan:
+            walk.unreadable.discard(d)
+            try:
+                st = host.fs.stat(d)
+            except FileNotFoundError:
+                walk.fingerprints.pop(d, None)
+                walk.dir_counts.pop(d, None)
+                continue
+            except OSError:
+                walk.errors += 1
+                walk.unreadable.add(d)
+                continue
+            walk.fingerprints.pop(d, None)
+            walk.dir_counts.pop(d, None)
+            self.add_watch(d)
+            for sub, sub_st in _scan_dir(walk, d, st, host, force=True):
+                if sub not in walk.fingerprints and sub not in rescan:
+                    _walk_tree(walk, sub, sub_st, host, force=True, watcher=self)
+        walk.files_count = sum(walk.dir_counts.values())
+        _roll_up(walk)
+        walk.elapsed = time.time() - start
+        self.removed.clear()
+        self.base = walk
+        log(f"👁 Media watcher: rescanned {len(rescan)} of {len(walk.fingerprints)} directories.")
+        return walk
+
+    def ack(self):
+        """The store now reflects every event seen so far."""
+        self.dirty.clear()
+
+# =========================
+# Stage 0: visibility guard
+# =========================
+def build_media_visibility_stats(walk):
+    files_count = walk.files_count
+    errors = walk.errors
+    dirs_ok = walk.dirs_ok
+    dirs_missing = walk.dirs_missing
+    secs = walk.elapsed
     stats = {
         'files_count': files_count,
         'dirs_ok': dirs_ok,
@@ -307,7 +2116,8 @@ def build_media_visibility_stats():
         'elapsed': secs,
     }
     log(f"📁 Library visibility: files~{files_count}, dirs_ok={dirs_ok}/{len(MEDIA_DIRS)}, "
-        f"missing={len(dirs_missing)}, errors={errors}, in {secs:.1f}s.")
+        f"missing={len(dirs_missing)}, errors={errors}, listed={walk.listed}/{len(walk.fingerprints)} dirs, "
+        f"in {secs:.1f}s.")
     if dirs_missing:
         log(f"⚠ Missing/Unreadable media dirs: {', '.join(dirs_missing)}")
     ok = True
@@ -319,25 +2129,179 @@ def build_media_visibility_stats():
             ok = False
     return ok, stats
 
+# =========================
+# Torrent table (sync/maindata rid deltas)
+# =========================
+TORRENT_WATCH_FIELDS = ('state', 'tags', 'save_path', 'completion_on', 'last_activity')
+
+class TorrentTable:
+    """
+    In-memory torrent list kept current through sync/maindata. After the first
+    full update only changed torrents are sent; `dirty` collects hashes whose
+    watched fields changed until a cycle completes and calls ack().
+    """
+    def __init__(self):
+        self.rid = 0
+        self.torrents = {}
+        self.dirty = set()
+
+    def sync(self, qb):
+        data = qb.get_json('sync/maindata', params={'rid': self.rid})
+        if data.get('full_update'):
+            old = self.torrents
+            self.torrents = {}
+            for h, t in (data.get('torrents') or {}).items():
+                t['hash'] = h
+                prev = old.get(h)
+                if prev is None or any(prev.get(k) != t.get(k) for k in TORRENT_WATCH_FIELDS):
+                    self.dirty.add(h)
+                self.torrents[h] = t
+        else:
+            for h, delta in (data.get('torrents') or {}).items():
+                t = self.torrents.get(h)
+                if t is None:
+                    t = self.torrents[h] = {'hash': h}
+                    self.dirty.add(h)
+                elif any(k in delta and delta[k] != t.get(k) for k in TORRENT_WATCH_FIELDS):
+                    self.dirty.add(h)
+                t.update(delta)
+            for h in data.get('torrents_removed') or []:
+                self.torrents.pop(h, None)
+                self.dirty.discard(h)
+        self.rid = data.get('rid', self.rid)
+        return list(self.torrents.values())
+
+    def load_full(self, torrents):
+        """Fallback when sync/maindata is unavailable: everything counts as changed."""
+        self.rid = 0
+        self.torrents = {t['hash']: t for t in torrents}
+        self.dirty = set(self.torrents)
+        return torrents
+
+    def ack(self):
+        self.dirty.clear()
+
+# =========================
+# Torrent file catalog (once per cycle)
+# =========================
+def _needs_files(t, pending, downloads_dir, now):
+    if not t['save_path'].startswith(downloads_dir):
+        return False
+    if is_actively_seeding(t) or is_recently_active(t, ACTIVE_GRACE_MINUTES, now):
+        return ACTIVE_INODE_SHIELD  # only the shield looks at active torrents
+    return t['hash'] in pending and not is_too_new(t, MIN_COMPLETED_AGE_HOURS, now)
+
+def build_torrent_file_catalog(inst, torrents, pending, now):
+    """
+    Returns {hash: [file dicts]} for every torrent the shield or Stage 1 will read
+    (active torrents for the shield, `pending` hashes for Stage 1).
+    inst.files_cache maps hash -> {'completion_on', 'files'}; a completed torrent's file
+    list never changes, so entries live until the torrent disappears or is
+    re-completed. Completed torrents are served from it; the rest are fetched
+    concurrently with at most QB_FILES_WORKERS requests in flight.
+    """
+    start = time.time()
+    qb, files_cache = inst.client, inst.files_cache
+    catalog = {}
+    to_fetch = []
+    for t in torrents:
+        if not _needs_files(t, pending, inst.downloads_dir, now):
+            continue
+        h = t['hash']
+        co = t.get('completion_on')
+        ent = files_cache.get(h)
+        if ent and ent['completion_on'] == co:
+            catalog[h] = ent['files']
+        else:
+            to_fetch.append((h, co))
+    cached = len(catalog)
+
+    def _fetch(item):
+        h, co = item
+        try:
+            return h, co, qb.get_torrent_files(h)
+        except Exception:
+            return h, co, None
+
+    errors = 0
+    if to_fetch:
+        with ThreadPoolExecutor(max_workers=min(QB_FILES_WORKERS, len(to_fetch))) as ex:
+            for h, co, files in ex.map(_fetch, to_fetch):
+                if files is None:
+                    errors += 1
+                    continue
+                catalog[h] = files
+                if isinstance(co, int) and co > 0:
+                    files_cache[h] = {'completion_on': co, 'files': files}
+
+    live = {t['hash'] for t in torrents}
+    for h in list(files_cache):
+        if h not in live:
+            del files_cache[h]
+
+    METRICS.inc('qbit_tagger_cache_lookups_total', cached, cache='torrent_files', result='hit')
+    METRICS.inc('qbit_tagger_cache_lookups_total', len(to_fetch), cache='torrent_files', result='miss')
+    log(f"📚 File catalog: {len(catalog)} torrents, cached={cached}, fetched={len(to_fetch) - errors}, "
+        f"errors={errors}, in {time.time() - start:.1f}s.")
+    return catalog
+
+# =========================
+# Downloads link counts (hardlink accounting)
+# =========================
+def count_download_links(downloads_dirs, fs):
+    """
+    Returns {(dev, ino): names under downloads_dirs} for files with a whitelisted
+    extension, cross-seed duplicates included. Every instance's downloads root is
+    counted together, so links between instances stay local. Directories at or
+    under a MEDIA_DIRS entry are not entered: a media hardlink is never counted
+    as a download-side link. Only d_type and d_ino from scandir are used, so no
+    file is stat()ed. Unreadable directories are skipped. Both can only
+    undercount, so a file is never wrongly taken as having no link outside
+    downloads.
+    """
+    start = time.time()
+    counts = defaultdict(int)
+    errors = skipped_media = 0
+    media = tuple(m.rstrip(os.sep) for m in MEDIA_DIRS)
+    def _in_media(p):
+        return any(p == m or p.startswith(m + os.sep) for m in media)
+    roots = sorted(set(d.rstrip(os.sep) for d in downloads_dirs))
+    stack = [d for d in roots if not any(d.startswith(r + os.sep) for r in roots)]
+    while stack:
+        d = stack.pop()
+        if _in_media(d):
+            skipped_media += 1
+            continue
+        try:
+            dev = fs.stat(d).st_dev
+            with fs.scandir(d) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False) and _media_ext_ok(entry.name):
+                        counts[(dev, entry.inode())] += 1
+        except OSError:
+            errors += 1
+    log(f"🔗 Download links: {len(counts)} inodes, errors={errors}, skipped_media_dirs={skipped_media}, "
+        f"in {time.time() - start:.1f}s.")
+    return counts
+
 # =========================
 # Stage 1: enumerate torrents, filter & collect wanted sizes
 # =========================
-def build_active_inode_shield(qb, torrents):
+def build_active_inode_shield(catalog, torrents, downloads_dir, host):
     shield = set()
     protected = 0
+    now = host.now()
     for t in torrents:
-        if not t['save_path'].startswith(DOWNLOADS_DIR):
+        if not t['save_path'].startswith(downloads_dir):
             continue
-        if not (is_actively_seeding(t) or is_recently_active(t, ACTIVE_GRACE_MINUTES)):
+        if not (is_actively_seeding(t) or is_recently_active(t, ACTIVE_GRACE_MINUTES, now)):
             continue
-        try:
-            files = qb.get_torrent_files(t['hash'])
-        except Exception:
-            continue
-        for fi in files:
+        for fi in catalog.get(t['hash'], []):
             p = os.path.join(t['save_path'], fi['name'])
             try:
-                st = os.stat(p)
+                st = host.fs.stat(p)
             except Exception:
                 continue
             if is_media_candidate(p, st.st_size):
@@ -348,37 +2312,38 @@ def build_active_inode_shield(qb, torrents):
         log("🛡 Active inode shield: empty.")
     return shield
 
-def collect_torrent_candidates(qb, torrents, active_shield):
+def collect_torrent_candidates(catalog, torrents, active_shield, downloads_dir, host, link_counts=None):
     """
+    active_shield: inodes of active torrents, from every instance.
+    link_counts: optional {(dev, ino): links seen under the downloads roots}; a file whose
+    st_nlink is fully explained by it is marked local_only and needs no media lookup.
     Returns:
       wanted_sizes: set of sizes we must index in MEDIA_DIRS
-      t_candidates: {hash: [{'path':..., 'size':..., 'dev':..., 'ino':..., 'nlink':...}, ...]}
+      t_candidates: {hash: [{'path':..., 'size':..., 'mtime':..., 'dev':..., 'ino':..., 'nlink':...}, ...]}
       meta: counters
     """
     wanted_sizes = set()
     t_candidates = {}
-    skipped_active = skipped_recent = skipped_min_age = skipped_shield = 0
+    skipped_active = skipped_recent = skipped_min_age = skipped_shield = local_only = 0
+    now = host.now()
     for t in torrents:
-        if not t['save_path'].startswith(DOWNLOADS_DIR):
+        if not t['save_path'].startswith(downloads_dir):
             continue
         if is_actively_seeding(t):
             skipped_active += 1; continue
-        if is_recently_active(t, ACTIVE_GRACE_MINUTES):
+        if is_recently_active(t, ACTIVE_GRACE_MINUTES, now):
             skipped_recent += 1; continue
-        if is_too_new(t, MIN_COMPLETED_AGE_HOURS):
+        if is_too_new(t, MIN_COMPLETED_AGE_HOURS, now):
             skipped_min_age += 1; continue
 
-        try:
-            files = qb.get_torrent_files(t['hash'])
-        except Exception:
-            files = []
+        files = catalog.get(t['hash'], [])
 
         cand_list = []
         shield_hit = False
         for fi in files:
             p = os.path.join(t['save_path'], fi['name'])
             try:
-                st = os.stat(p)
+                st = host.fs.stat(p)
             except Exception:
                 continue
             if not is_media_candidate(p, st.st_size):
@@ -386,9 +2351,14 @@ def collect_torrent_candidates(qb, torrents, active_shield):
             if ACTIVE_INODE_SHIELD and (st.st_dev, st.st_ino) in active_shield:
                 shield_hit = True; break
             if st.st_nlink and st.st_nlink > 1:
-                cand_list.append({'path': p, 'size': st.st_size, 'dev': st.st_dev,
-                                  'ino': st.st_ino, 'nlink': st.st_nlink})
-                wanted_sizes.add(st.st_size)
+                cf = {'path': p, 'size': st.st_size, 'mtime': int(st.st_mtime),
+                      'dev': st.st_dev, 'ino': st.st_ino, 'nlink': st.st_nlink}
+                if link_counts is not None and link_counts.get((st.st_dev, st.st_ino), 0) >= st.st_nlink:
+                    cf['local_only'] = True
+                    local_only += 1
+                else:
+                    wanted_sizes.add(st.st_size)
+                cand_list.append(cf)
 
         if shield_hit:
             skipped_shield += 1
@@ -400,328 +2370,337 @@ def collect_torrent_candidates(qb, torrents, active_shield):
     meta = dict(skipped_active=skipped_active,
                 skipped_recent=skipped_recent,
                 skipped_min_age=skipped_min_age,
-                skipped_shield=skipped_shield)
+                skipped_shield=skipped_shield,
+                local_only=local_only)
     return wanted_sizes, t_candidates, meta
 
 # =========================
-# Stage 2: build media signature set with persistent cache
+# Stage 2: build media link index with persistent cache
 # =========================
-def build_media_signature_set(wanted_sizes, budget):
+def build_media_link_index(walk, store, hash_cache, wanted_sizes, hash_sizes, budget, host):
     """
+    Folds this cycle's MediaWalk into the store, then builds the link index from
+    the store's size index: rows of unchanged directories are served as cached.
+    hash_sizes maps each quickhash-fallback size to its number of torrent files.
+    Unhashed media rows of those sizes form a work queue, processed a whole size
+    at a time from a cursor kept in the store, so a budget-limited cycle leaves
+    complete sizes behind and the next cycle resumes where this one stopped.
     Returns:
-      sig_set: set of (size, quickhash)
+      link_index: LinkIndex with (dev, ino) of media files of wanted sizes, plus
+                  (size, quickhash) signatures and complete_sizes for hash_sizes
       index_stats: dict with counts/timings + index_complete flag
-      cache_updated: bool
     """
-    sig_set = set()
-    files_seen = set()
+    link_index = LinkIndex(walk.root_devs, hash_cache, host)
     hashed_new = 0
     cached_hits = 0
     errors = 0
     start = time.time()
 
-    cache_ok = _ensure_dir(CACHE_DIR)
-    media_cache_path = os.path.join(CACHE_DIR, 'media_hashes.json') if cache_ok else None
-    media_cache = _load_json(media_cache_path, {"entries": {}, "dir_fingerprints": {}}) if media_cache_path else {"entries": {}, "dir_fingerprints": {}}
-
-    entries = media_cache.get("entries", {})
-    dir_fingerprints = media_cache.get("dir_fingerprints", {})
+    removed = store.apply_media_walk(walk)
 
-    # Walk only wanted sizes
-    for media_dir in MEDIA_DIRS:
-        if not _dir_accessible(media_dir):
+    pending = defaultdict(list)  # size -> [(dir, name, path, mtime, dev, ino)] still to hash
+    for d, name, sz, mtime, dev, ino, qhash in store.media_by_sizes(wanted_sizes):
+        link_index.inodes.add((dev, ino))
+        link_index.sizes.add(sz)
+        if d not in walk.dir_files:
+            cached_hits += 1
+        # quickhash only sizes that cannot be resolved by inode (budgeted, below)
+        if sz not in hash_sizes:
             continue
-        for root, dirs, files in os.walk(media_dir):
-            fp = _dir_fingerprint(root, entry_count=len(files) + len(dirs))
-            cached_fp = dir_fingerprints.get(root)
-            if fp is not None:
-                dir_fingerprints[root] = fp
-            if fp is not None and cached_fp is not None and fp == cached_fp and root not in files_seen:
-                prefix = root + os.sep
-                for path, ent in entries.items():
-                    if not path.startswith(prefix):
-                        continue
-                    sz = ent.get('size')
-                    qh = ent.get('qhash')
-                    if sz not in wanted_sizes or not qh:
-                        continue
-                    if not is_media_candidate(path, sz):
-                        continue
-                    files_seen.add(path)
-                    sig_set.add((sz, qh))
-                    cached_hits += 1
-                files_seen.add(root)
-                dirs[:] = []
-                continue
-            for fn in files:
-                path = os.path.join(root, fn)
-                try:
-                    st = os.stat(path)
-                except Exception:
-                    errors += 1; continue
-                sz = st.st_size
-                if sz not in wanted_sizes:
-                    continue
-                if not is_media_candidate(path, sz):
-                    continue
-
-                key = path
-                files_seen.add(key)
-                ent = entries.get(key)
-                # cache valid?
-                if ent and ent.get('size') == sz and ent.get('mtime') == int(st.st_mtime) \
-                   and ent.get('ino') == st.st_ino and ent.get('dev') == st.st_dev \
-                   and ent.get('qhash'):
-                    sig_set.add((sz, ent['qhash'])); cached_hits += 1
-                    continue
+        if not qhash:
+            qhash = hash_cache.get(dev, ino, sz, mtime)
+            if qhash:
+                store.set_media_qhash(d, name, qhash)
+        if qhash:
+            link_index.sigs.add((sz, qhash))
+        else:
+            pending[sz].append((d, name, os.path.join(d, name), mtime, dev, ino))
+
+    # Take whole sizes from the cursor on while the budget covers both their media
+    # rows and the torrent files waiting on them; always take at least one
+    queue = sorted(pending)
+    cursor = store.get_meta('hash_cursor') or 0
+    i = bisect.bisect_left(queue, cursor)
+    queue = queue[i:] + queue[:i]
+    batch, cost = [], 0
+    for sz in queue:
+        sz_cost = (len(pending[sz]) + hash_sizes[sz]) * _qhash_cost(sz)
+        if batch and cost + sz_cost > budget.available():
+            break
+        batch.append(sz)
+        cost += sz_cost
+
+    to_hash = [(sz,) + row for sz in batch for row in pending[sz]]
+    results = quick_hash_many(((path, path, dev) for _, _, _, path, _, dev, _ in to_hash), budget, host)
+    short = set()  # sizes with a row skipped for lack of budget
+    for sz, d, name, path, mtime, dev, ino in to_hash:
+        qh = results.get(path)
+        if qh:
+            store.set_media_qhash(d, name, qh)
+            hash_cache.put(dev, ino, sz, mtime, qh)
+            link_index.sigs.add((sz, qh))
+            hashed_new += 1
+        elif budget.exhausted:
+            short.add(sz)
+        else:
+            errors += 1
 
-                # compute quickhash (budgeted)
-                qh = quick_hash_budgeted(path, budget)
-                if not qh:
-                    # no hash -> cannot include in signature set
-                    continue
-                hashed_new += 1
-                entries[key] = {
-                    'size': sz, 'mtime': int(st.st_mtime),
-                    'ino': st.st_ino, 'dev': st.st_dev, 'qhash': qh
-                }
-                sig_set.add((sz, qh))
-
-    # prune removed files from cache
-    removed = 0
-    if entries:
-        for k in list(entries.keys()):
-            if k not in files_seen and entries[k].get('size') in wanted_sizes:
-                entries.pop(k, None); removed += 1
-
-    media_cache['entries'] = entries
-    media_cache['dir_fingerprints'] = dir_fingerprints
-    cache_updated = False
-    if media_cache_path:
-        try:
-            _atomic_save_json(media_cache_path, media_cache)
-            cache_updated = True
-        except Exception:
-            pass
+    link_index.complete_sizes = {sz for sz in hash_sizes if sz not in pending or (sz in batch and sz not in short)}
+    waiting = [sz for sz in queue if sz not in link_index.complete_sizes]
+    next_cursor = waiting[0] if waiting else 0
+    if next_cursor != cursor:
+        store.set_meta('hash_cursor', next_cursor)
 
     secs = time.time() - start
-    index_complete = not budget.exhausted  # if budget ran out, we might have missed hashes
+    link_index.sig_complete = not waiting
     index_stats = {
-        'sig_count': len(sig_set),
+        'inode_count': len(link_index.inodes),
+        'sig_count': len(link_index.sigs),
         'cached_hits': cached_hits,
         'hashed_new': hashed_new,
+        'inode_hash_hits': hash_cache.hits,
         'cache_pruned': removed,
         'errors': errors,
         'elapsed': secs,
-        'index_complete': index_complete,
+        'index_complete': link_index.sig_complete,
+        'sizes_pending': len(waiting),
         'budget_used_mb': (budget.total - budget.remaining) // (1024*1024),
         'budget_total_mb': budget.total // (1024*1024),
     }
-    log(f"🔎 Media signatures: sigs={len(sig_set)}, cached={cached_hits}, new_hashes={hashed_new}, "
-        f"pruned={removed}, errors={errors}, in {secs:.1f}s, budget={index_stats['budget_used_mb']}/{index_stats['budget_total_mb']} MiB.")
-    if not index_complete:
-        log("⚠ Signature index incomplete (hash budget exhausted). Will skip tagging where a signature match is required.")
-    return sig_set, index_stats, cache_updated
+    log(f"🔎 Media index: inodes={len(link_index.inodes)}, sigs={len(link_index.sigs)}, cached={cached_hits}, "
+        f"new_hashes={hashed_new}, inode_hash_hits={hash_cache.hits}, pruned={removed}, errors={errors}, in {secs:.1f}s, "
+        f"budget={index_stats['budget_used_mb']}/{index_stats['budget_total_mb']} MiB.")
+    if waiting:
+        log(f"⚠ Signature index: {len(waiting)}/{len(hash_sizes)} size(s) still pending (hash budget or rate window used up); "
+            f"torrents needing them wait, the next cycle resumes at size {next_cursor}.")
+    return link_index, index_stats
 
 # =========================
 # Decision cache (per torrent)
 # =========================
-def load_torrent_cache():
-    path = os.path.join(CACHE_DIR, 'torrent_state.json') if _ensure_dir(CACHE_DIR) else None
-    raw = _load_json(path, {}) if path else {}
+def load_torrent_cache(store, instance=''):
     current_cfg = {
         'media_link_min_percent': MEDIA_LINK_MIN_PERCENT,
         'media_link_tag_steps': MEDIA_LINK_TAG_STEPS,
     }
-
-    if isinstance(raw, dict) and 'entries' in raw:
-        entries = raw.get('entries') or {}
-        cached_cfg = raw.get('config') or {}
-    elif isinstance(raw, dict):
-        entries = raw
-        cached_cfg = {}
-    else:
-        entries = {}
-        cached_cfg = {}
-
-    if cached_cfg != current_cfg and entries:
+    cached_cfg = store.get_meta('torrent_config') or {}
+    # the config is shared, so a change invalidates every instance's decisions
+    if cached_cfg != current_cfg and store.clear_torrent_states():
         log("ℹ️ Torrent cache config changed, invalidating entries.")
-        entries = {}
+    store.set_meta('torrent_config', current_cfg)
+    entries = store.load_torrent_states(instance)
 
-    return path, {'entries': entries, 'config': current_cfg}
+    return {'entries': entries, 'config': current_cfg, 'dirty': set()}
 
-def save_torrent_cache(path, data):
-    if not path:
-        return
-    payload = data
-    if not isinstance(payload, dict) or 'entries' not in payload:
-        payload = {'entries': data}
-    payload.setdefault('config', {
-        'media_link_min_percent': MEDIA_LINK_MIN_PERCENT,
-        'media_link_tag_steps': MEDIA_LINK_TAG_STEPS,
-    })
+def save_torrent_cache(store, tstate, instance=''):
+    """Upsert only the decisions remembered since the last save (committed by DaemonState)."""
+    entries = tstate.get('entries', {})
+    dirty = tstate.get('dirty') or set()
     try:
-        _atomic_save_json(path, payload)
-    except Exception:
-        pass
+        store.save_torrent_states({h: entries[h] for h in dirty if h in entries}, instance)
+        dirty.clear()
+    except Exception as e:
+        log(f"⚠ decision cache save failed: {e}")
 
-def can_reuse_decision(t, tstate, existing_tags):
+def can_reuse_decision(inst, t, existing_tags, now):
     if DECISION_TTL_HOURS <= 0:
         return False
-    entries = tstate.get('entries', tstate)
-    entry = entries.get(t.get('hash'))
+    entry = inst.tstate['entries'].get(t.get('hash'))
     if not entry:
         return False
     if entry.get('completion_on') != t.get('completion_on'):
         return False
     if entry.get('save_path') != t.get('save_path'):
         return False
-    if int(time.time()) - entry.get('decided_at', 0) > DECISION_TTL_HOURS * 3600:
+    if now - entry.get('decided_at', 0) > DECISION_TTL_HOURS * 3600:
         return False
 
-    coverage_tags_present = {tag for tag in existing_tags if tag.startswith(MEDIA_LINK_TAG_PREFIX)}
+    coverage_tags_present = {tag for tag in existing_tags if tag.startswith(inst.tag_prefix)}
     expected_coverage_tag = entry.get('coverage_tag')
     coverage_ok = coverage_tags_present == ({expected_coverage_tag} if expected_coverage_tag else set())
 
     decision = entry.get('decision')
     if decision == 'orphan':
-        decision_ok = ORPHAN_TAG in existing_tags
+        decision_ok = inst.orphan_tag in existing_tags
     elif decision == 'linked':
-        decision_ok = ORPHAN_TAG not in existing_tags
+        decision_ok = inst.orphan_tag not in existing_tags
     else:
         decision_ok = False
 
     return decision_ok and coverage_ok
 
-def remember_decision(t, tstate, decision, coverage_pct=None, coverage_tag=None):
+def remember_decision(t, tstate, decision, now, coverage_pct=None, coverage_tag=None):
     entries = tstate.setdefault('entries', {})
     entries[t['hash']] = {
         'completion_on': t.get('completion_on'),
         'save_path': t.get('save_path'),
         'decision': decision,  # 'linked' or 'orphan'
-        'decided_at': int(time.time()),
+        'decided_at': now,
         'coverage_pct': coverage_pct,
         'coverage_tag': coverage_tag,
     }
+    tstate.setdefault('dirty', set()).add(t['hash'])
 
 # =========================
-# Tag verification helpers
+# Tag reconciler
 # =========================
-def verify_tag_state(qb, hashes, tag, expect_present):
-    successes = []
-    failures = []
+VERIFY_CHUNK = 150  # hashes per torrents/info request; keeps the query string well under 8 KiB
+TAG_WRITE_MAX_BYTES = 512 * 1024  # form body per addTags/removeTags; under common reverse-proxy limits (nginx: 1 MiB)
+
+def _managed_tags(inst, tags):
+    """The tags this tool owns on inst: its orphan tag and coverage tags."""
+    return {tag for tag in tags if tag == inst.orphan_tag or tag.startswith(inst.tag_prefix)}
+
+def _write_chunks(hashes, tag):
+    """Split hashes into as few tag writes as fit TAG_WRITE_MAX_BYTES (and BATCH_SIZE, if set)."""
+    fixed = len('hashes=&tags=') + len(quote(tag, safe=''))
+    chunk, size = [], fixed
     for h in hashes:
+        cost = len(h) + 3  # '|' is sent as %7C
+        if chunk and (size + cost > TAG_WRITE_MAX_BYTES or (BATCH_SIZE > 0 and len(chunk) >= BATCH_SIZE)):
+            yield chunk
+            chunk, size = [], fixed
+        chunk.append(h)
+        size += cost
+    if chunk:
+        yield chunk
+
+def fetch_tags(qb, hashes):
+    """Current tags by hash via torrents/info?hashes=a|b|c; None for hashes whose request failed."""
+    tags = {}
+    for i in range(0, len(hashes), VERIFY_CHUNK):
+        chunk = hashes[i:i + VERIFY_CHUNK]
         try:
-            tinfo = qb.get_torrent(h)
+            infos = qb.torrents(hashes='|'.join(chunk))
         except Exception:
-            failures.append((h, 'api_error'))
+            tags.update((h, None) for h in chunk)
             continue
-        if not tinfo:
-            failures.append((h, 'torrent_missing'))
-            continue
-        tags = set((tinfo.get('tags') or '').split(',')) if tinfo.get('tags') else set()
-        has_tag = tag in tags
-        if has_tag == expect_present:
-            successes.append(h)
-        else:
-            failures.append((h, 'missing_tag' if not has_tag else 'unexpected_tag'))
-    return successes, failures
-
-def apply_and_log_tag_changes(qb, action, tag, hashes, name_lookup, coverage_info, run_id, seq_ref, http_func):
-    if not hashes:
-        return 0
-    http_ok = http_func(hashes, tag)
-    expect_present = action == 'tag'
-    successes, failures = verify_tag_state(qb, hashes, tag, expect_present)
-    seen = {h for h in successes}
-    seen.update(h for h, _ in failures)
-    for h in hashes:
-        if h not in seen:
-            failures.append((h, 'verify_failed' if http_ok else 'http_error'))
+        tags.update((t.get('hash'), _tag_set(t)) for t in infos)
+    return tags
+
+def diff_tags(current, desired):
+    """{(action, tag): [hashes]} turning current into desired (both {hash: managed tag set})."""
+    changes = defaultdict(list)
+    for h, want in desired.items():
+        have = current.get(h, set())
+        for tag in want - have:
+            changes[('tag', tag)].append(h)
+        for tag in have - want:
+            changes[('untag', tag)].append(h)
+    return changes
+
+def reconcile_tags(inst, current, desired, name_lookup, coverage_info, run_id):
+    if not desired:
+        return {'tagged': 0, 'untagged': 0, 'writes': 0}
+    with METRICS.time('tag_writes'):
+        return _reconcile_tags(inst, current, desired, name_lookup, coverage_info, run_id)
+
+def _reconcile_tags(inst, current, desired, name_lookup, coverage_info, run_id):
+    """
+    Write the difference between current and desired tags with one bulk call per
+    tag and size-limited chunk, then verify every touched torrent in one pass.
+    Adds go first, so a torrent moving between coverage tags is never without one.
+    """
+    changes = diff_tags(current, desired)
+    if not changes:
+        return {'tagged': 0, 'untagged': 0, 'writes': 0}
+    writes = 0
+    http_ok = {}  # (action, tag, hash) -> bool
+    for action, tag in sorted(changes, key=lambda k: (k[0] != 'tag', k[1])):
+        http_func = add_tag_http if action == 'tag' else remove_tag_http
+        for chunk in _write_chunks(changes[(action, tag)], tag):
+            ok = bool(http_func(inst.client, chunk, tag))
+            writes += 1
+            http_ok.update(((action, tag, h), ok) for h in chunk)
+    log(f"🏷 Tag reconcile: {len(http_ok)} change(s) across {len(changes)} tag(s) in {writes} write(s).")
+
+    after = fetch_tags(inst.client, sorted({h for _, _, h in http_ok}))
     entries = []
-    for h in successes:
-        seq_ref[0] += 1
-        cov = coverage_info.get(h, {}) if coverage_info else {}
-        entries.append({
-            'ts': _timestamp(),
-            'run_id': run_id,
-            'seq': seq_ref[0],
-            'action': action,
-            'tag': tag,
-            'hash': h,
-            'name': name_lookup.get(h, {}).get('name'),
-            'coverage_pct': cov.get('coverage_pct'),
-            'coverage_tag': cov.get('coverage_tag'),
-            'success': True,
-            'error': None,
-        })
-    for h, reason in failures:
-        seq_ref[0] += 1
-        cov = coverage_info.get(h, {}) if coverage_info else {}
-        entries.append({
+    done = defaultdict(int)  # (action, tag) -> verified changes
+    for (action, tag, h), ok in http_ok.items():
+        tags = after.get(h)
+        if tags is None:
+            error = 'api_error' if h in after else 'torrent_missing'
+        elif (tag in tags) == (action == 'tag'):
+            error = None
+        elif not ok:
+            error = 'http_error'
+        else:
+            error = 'missing_tag' if action == 'tag' else 'unexpected_tag'
+        if error is None:
+            done[(action, tag)] += 1
+        cov = coverage_info.get(h, {})
+        entry = {
             'ts': _timestamp(),
             'run_id': run_id,
-            'seq': seq_ref[0],
+            'seq': len(entries) + 1,
             'action': action,
             'tag': tag,
             'hash': h,
             'name': name_lookup.get(h, {}).get('name'),
             'coverage_pct': cov.get('coverage_pct'),
             'coverage_tag': cov.get('coverage_tag'),
-            'success': False,
-            'error': reason or ('http_error' if not http_ok else 'verify_failed'),
-        })
-    if entries:
-        log_actions(entries)
-    return len(successes)
+            'success': error is None,
+            'error': error,
+        }
+        if inst.name:
+            entry['instance'] = inst.name
+        entries.append(entry)
+    log_actions(entries)
+    for action in ('tag', 'untag'):
+        ok = sum(n for (a, _), n in done.items() if a == action)
+        METRICS.inc('qbit_tagger_tag_changes_total', ok, action=action, result='ok', **inst.labels)
+        METRICS.inc('qbit_tagger_tag_changes_total', sum(1 for a, _, _ in http_ok if a == action) - ok,
+                    action=action, result='failed', **inst.labels)
+    return {'tagged': done[('tag', inst.orphan_tag)], 'untagged': done[('untag', inst.orphan_tag)],
+            'writes': writes}
 
 # =========================
 # Evaluate torrents with sig set
 # =========================
-def evaluate_and_tag(qb, torrents, t_candidates, sig_set, index_complete, tstate, torrent_lookup, run_id):
-    orphan_batch, untag_batch = [], []
-    total_tagged = total_untagged = 0
+def evaluate_and_tag(inst, torrents, t_candidates, link_index, torrent_lookup, run_id, now):
+    """Decide every pending torrent into a desired tag map, then reconcile it in bulk."""
     skipped_reuse = skipped_inconclusive = 0
-    seq_ref = [0]
     coverage_info = {}
+    current, desired = {}, {}  # hash -> managed tags
 
-    coverage_add = defaultdict(list)  # tag -> [hashes]
-    coverage_remove = defaultdict(list)  # tag -> [hashes]
-
+    to_decide = []
     for i, t in enumerate(torrents, 1):
         if MAX_TORRENTS > 0 and i > MAX_TORRENTS:
             break
-        if not t['save_path'].startswith(DOWNLOADS_DIR):
+        if not t['save_path'].startswith(inst.downloads_dir):
             continue
-        h = t['hash']
-        cand_files = t_candidates.get(h)
+        cand_files = t_candidates.get(t['hash'])
         if not cand_files:
             # no eligible files -> treat as "not linked" only if we choose to; safer to require evidence
             continue
 
-        existing_tags = set((t.get('tags') or '').split(',')) if t.get('tags') else set()
+        existing_tags = _tag_set(t)
 
         # decision reuse? only if tags already reflect cached decision/coverage
-        if can_reuse_decision(t, tstate, existing_tags):
+        if can_reuse_decision(inst, t, existing_tags, now):
             skipped_reuse += 1
             continue
+        to_decide.append((t, cand_files, existing_tags))
 
-        # If our media signatures are incomplete, be conservative: skip
-        if not index_complete:
-            skipped_inconclusive += 1
-            continue
+    # Hash the quickhash-fallback files of every torrent we must decide, in parallel
+    link_index.prehash([cf for _, cand_files, _ in to_decide for cf in cand_files], TORRENT_HASH_BUDGET)
+
+    for t, cand_files, existing_tags in to_decide:
+        h = t['hash']
 
-        # Check each candidate torrent file: (size, qhash) in sig_set ?
+        # Check each candidate torrent file against the link index; if a file
+        # needs the signature fallback and that index is incomplete, be conservative: skip
         linked_matches = 0
         linked_bytes = 0
         total_bytes = sum(cf['size'] for cf in cand_files)
         inconclusive = False
         for cf in cand_files:
-            tqh = quick_hash_budgeted(cf['path'], TORRENT_HASH_BUDGET)
-            if not tqh:
+            linked = link_index.resolve(cf, TORRENT_HASH_BUDGET)
+            if linked is None:
                 inconclusive = True
                 break
-            if (cf['size'], tqh) in sig_set:
+            if linked:
                 linked_matches += 1
                 linked_bytes += cf['size']
 
@@ -737,63 +2716,146 @@ def evaluate_and_tag(qb, torrents, t_candidates, sig_set, index_complete, tstate
         if MEDIA_LINK_TAG_STEPS:
             for step in MEDIA_LINK_TAG_STEPS:
                 if coverage_pct >= step:
-                    coverage_tag = f"{MEDIA_LINK_TAG_PREFIX}{step}%"
+                    coverage_tag = f"{inst.tag_prefix}{step}%"
                 else:
                     break
 
-        coverage_tags_present = {tag for tag in existing_tags if tag.startswith(MEDIA_LINK_TAG_PREFIX)}
-
-        if coverage_tag and coverage_tag not in existing_tags:
-            coverage_add[coverage_tag].append(h)
-        for tag in coverage_tags_present:
-            if tag != coverage_tag:
-                coverage_remove[tag].append(h)
-
-        has_tag = ORPHAN_TAG in (t.get('tags') or '')
-        if not linked_enough:
-            orphan_batch.append(h)
-            coverage_info[h] = {'coverage_pct': coverage_pct, 'coverage_tag': coverage_tag}
-            if len(orphan_batch) >= BATCH_SIZE:
-                total_tagged += apply_and_log_tag_changes(qb, 'tag', ORPHAN_TAG, orphan_batch, torrent_lookup, coverage_info, run_id, seq_ref, add_tag_http)
-                orphan_batch.clear()
-            remember_decision(t, tstate, 'orphan', coverage_pct, coverage_tag)
-        else:
-            if has_tag:
-                untag_batch.append(h)
-                coverage_info[h] = {'coverage_pct': coverage_pct, 'coverage_tag': coverage_tag}
-                if len(untag_batch) >= BATCH_SIZE:
-                    total_untagged += apply_and_log_tag_changes(qb, 'untag', ORPHAN_TAG, untag_batch, torrent_lookup, coverage_info, run_id, seq_ref, remove_tag_http)
-                    untag_batch.clear()
-            remember_decision(t, tstate, 'linked', coverage_pct, coverage_tag)
-
-    if orphan_batch:
-        total_tagged += apply_and_log_tag_changes(qb, 'tag', ORPHAN_TAG, orphan_batch, torrent_lookup, coverage_info, run_id, seq_ref, add_tag_http)
-    if untag_batch:
-        total_untagged += apply_and_log_tag_changes(qb, 'untag', ORPHAN_TAG, untag_batch, torrent_lookup, coverage_info, run_id, seq_ref, remove_tag_http)
-
-    # Apply coverage tags
-    for tag, hashes in coverage_add.items():
-        apply_and_log_tag_changes(qb, 'tag', tag, hashes, torrent_lookup, coverage_info, run_id, seq_ref, add_tag_http)
-    for tag, hashes in coverage_remove.items():
-        apply_and_log_tag_changes(qb, 'untag', tag, hashes, torrent_lookup, coverage_info, run_id, seq_ref, remove_tag_http)
+        want = set() if linked_enough else {inst.orphan_tag}
+        if coverage_tag:
+            want.add(coverage_tag)
+        current[h] = _managed_tags(inst, existing_tags)
+        desired[h] = want
+        coverage_info[h] = {'coverage_pct': coverage_pct, 'coverage_tag': coverage_tag}
+        remember_decision(t, inst.tstate, 'linked' if linked_enough else 'orphan', now, coverage_pct, coverage_tag)
 
+    written = reconcile_tags(inst, current, desired, torrent_lookup, coverage_info, run_id)
     return {
-        'tagged': total_tagged,
-        'untagged': total_untagged,
+        'tagged': written['tagged'],
+        'untagged': written['untagged'],
+        'tag_writes': written['writes'],
         'skipped_reuse': skipped_reuse,
         'skipped_inconclusive': skipped_inconclusive
     }
 
+# =========================
+# Resident state (survives across cycles)
+# =========================
+class DaemonState:
+    """
+    Everything the daemon keeps between cycles: the cache store, directory
+    fingerprints, the instances (each with its decisions, torrent table and file
+    listings) and the media watcher. Read from disk once at startup; afterwards the store is only
+    committed when a cycle changed something and STATE_CHECKPOINT_SECONDS have
+    passed since the last commit, or on shutdown.
+    """
+    def __init__(self, host=None):
+        self.host = host or HOST  # replay_snapshot() passes one answered from the snapshot
+        path = os.path.join(CACHE_DIR, 'cache.db') if _ensure_dir(CACHE_DIR) else None
+        self.store = CacheStore(path)
+        self.fingerprints = self.store.dir_fingerprints()
+        self.instances = get_instances()
+        for inst in self.instances:
+            inst.tstate = load_torrent_cache(self.store, inst.name)
+        self.watcher = MediaWatcher() if MEDIA_WATCH else None
+        self.load = LoadMonitor() if LOAD_AWARE else None
+        self.last_commit = time.time()
+        self.prune_day = None
+        self.prune_inode_hashes()
+        self.store.commit()
+
+    def prune_inode_hashes(self):
+        """Expire stale inode quickhashes, at most once a day."""
+        today = int(self.host.clock.time() // 86400)
+        if self.prune_day != today:
+            self.prune_day = today
+            InodeHashCache(self.store, self.host.clock).prune()
+
+    def checkpoint(self, force=False):
+        """Stage remembered decisions and commit if the interval (or force) allows."""
+        for inst in self.instances:
+            save_torrent_cache(self.store, inst.tstate, inst.name)
+        if not self.store.pending():
+            return False
+        if not force and time.time() - self.last_commit < STATE_CHECKPOINT_SECONDS:
+            return False
+        try:
+            self.store.commit()
+        except Exception as e:
+            log(f"⚠ cache store commit failed: {e}")
+            return False
+        self.last_commit = time.time()
+        return True
+
+    def close(self):
+        self.checkpoint(force=True)
+        try:
+            self.store.close()
+        except Exception as e:
+            log(f"⚠ cache store close failed: {e}")
+
+_STATE = None  # created on the first cycle
+
+def get_state():
+    global _STATE
+    if _STATE is None:
+        _STATE = DaemonState()
+    return _STATE
+
 # Single budget instance used across run (media + torrents)
 TORRENT_HASH_BUDGET = None  # will be set per run
 
+def _prepare_instance(inst, host):
+    """
+    The network-bound part of a cycle for one instance: sync the torrent table,
+    pick the torrents to (re)decide, list their files and build its shield.
+    Returns None when the torrent list cannot be fetched.
+    """
+    with inst.logging():
+        qb = inst.client
+        try:
+            torrents = inst.table.sync(qb)
+        except Exception as e:
+            log(f"⚠ sync/maindata failed ({e}); falling back to full torrent list.")
+            try:
+                torrents = inst.table.load_full(qb.torrents())
+            except Exception as e:
+                log(f"Error fetching torrents: {e}")
+                return None
+
+        if MAX_TORRENTS > 0:
+            torrents = torrents[:MAX_TORRENTS]
+            log(f"⚙ Limiting to first {MAX_TORRENTS} torrents.")
+
+        # Only torrents that changed since the last cycle, or whose cached decision can no
+        # longer be reused, go through Stage 1 and evaluation
+        now = host.now()
+        pending = {t['hash'] for t in torrents
+                   if t['hash'] in inst.table.dirty or not can_reuse_decision(inst, t, _tag_set(t), now)}
+
+        # One file listing per torrent per cycle, shared by the shield and Stage 1
+        with METRICS.time('catalog'):
+            catalog = build_torrent_file_catalog(inst, torrents, pending, now)
+
+        # Build active inode shield
+        with METRICS.time('shield'):
+            shield = build_active_inode_shield(catalog, torrents, inst.downloads_dir, host) if ACTIVE_INODE_SHIELD else set()
+        return {'torrents': torrents, 'pending': pending, 'catalog': catalog, 'shield': shield}
+
 def run_cleanup():
-    if not all([QBITTORRENT_URL, QBITTORRENT_USER, QBITTORRENT_PASS]):
-        raise SystemExit("Missing qBittorrent env vars.")
+    """One cycle. Stages that run once per instance are observed once, as their summed time."""
+    METRICS.begin_cycle()
+    try:
+        _run_cycle()
+    finally:
+        METRICS.end_cycle()
 
+def _run_cycle():
     global TORRENT_HASH_BUDGET
     run_id = uuid.uuid4().hex
-    log(f"{VERSION} — url={QBITTORRENT_URL} — MIN_SIZE_MB={MIN_SIZE_MB} — EXT_WHITELIST={','.join(EXT_WHITELIST)} "
+    state = get_state()
+    instances = state.instances
+    log(f"{VERSION} — url={','.join(inst.url for inst in instances)} — MIN_SIZE_MB={MIN_SIZE_MB} "
+        f"— EXT_WHITELIST={','.join(EXT_WHITELIST)} "
         f"— ACTIVE_GRACE_MINUTES={ACTIVE_GRACE_MINUTES} — MIN_COMPLETED_AGE_HOURS={MIN_COMPLETED_AGE_HOURS} "
         f"— ACTIVE_INODE_SHIELD={int(ACTIVE_INODE_SHIELD)} — HASH_BUDGET_MB={HASH_BUDGET_MB} "
         f"— DECISION_TTL_HOURS={DECISION_TTL_HOURS} — CACHE_DIR={CACHE_DIR} "
@@ -803,64 +2865,172 @@ def run_cleanup():
         f"— LOG_USE_AMPM={int(LOG_USE_AMPM)}")
     log("Starting cleanup cycle...")
 
-    qb = get_qb_client()
-    if not qb:
+    live = []
+    for inst in instances:
+        with inst.logging():
+            if inst.connect():
+                live.append(inst)
+            else:
+                log("No connection to qBittorrent, skipping this instance.")
+    if not live:
         log("No connection to qBittorrent, skipping.")
+        METRICS.inc('qbit_tagger_cycles_total', result='no_connection')
         return
 
-    vis_ok, _ = build_media_visibility_stats()
+    cycle_start = time.monotonic()
+    store = state.store
+    host = state.host
+    load_scale = state.load.sample([inst.client for inst in live]) if state.load else 1.0
+
+    # One library walk per cycle feeds both the visibility guard and Stage 2, for every instance
+    with METRICS.time('visibility'):
+        if state.watcher:
+            walk = state.watcher.walk(state.fingerprints, host, defer_rescan=load_scale < 1)
+        else:
+            walk = walk_media_library(state.fingerprints, host)
+        vis_ok, _ = build_media_visibility_stats(walk)
+    METRICS.inc('qbit_tagger_cache_lookups_total', len(walk.fingerprints) - walk.listed, cache='media_dirs', result='hit')
+    METRICS.inc('qbit_tagger_cache_lookups_total', walk.listed, cache='media_dirs', result='miss')
     if not vis_ok:
         log("🛑 FAILSAFE: Library visibility not healthy. **No tag changes this cycle.**")
+        METRICS.inc('qbit_tagger_cycles_total', result='failsafe')
         return
 
-    try:
-        torrents = qb.torrents()
-    except Exception as e:
-        log(f"Error fetching torrents: {e}")
+    # Instances are independent until Stage 2: sync, file listings and shields run side by side
+    with ThreadPoolExecutor(max_workers=len(live)) as ex:
+        prepared = list(zip(live, ex.map(lambda inst: _prepare_instance(inst, host), live)))
+    work = [(inst, cyc) for inst, cyc in prepared if cyc is not None]
+    if not work:
+        METRICS.inc('qbit_tagger_cycles_total', result='error')
         return
+    if ACTIVE_INODE_SHIELD and len(work) < len(instances):
+        log("⚠ Active inode shield only covers the instances that answered this cycle.")
 
-    if MAX_TORRENTS > 0:
-        torrents = torrents[:MAX_TORRENTS]
-        log(f"⚙ Limiting to first {MAX_TORRENTS} torrents.")
-
-    torrent_lookup = {t['hash']: {'name': t.get('name'), 'save_path': t.get('save_path')} for t in torrents}
-
-    # Build active inode shield
-    active_shield = build_active_inode_shield(qb, torrents) if ACTIVE_INODE_SHIELD else set()
+    # A file seeding actively in any instance is shielded in all of them
+    active_shield = set().union(*(cyc['shield'] for _, cyc in work))
 
-    # Stage 1: filter + collect wanted sizes and candidate files
-    wanted_sizes, t_candidates, meta = collect_torrent_candidates(qb, torrents, active_shield)
-    log(f"🎯 Stage1: wanted_sizes={len(wanted_sizes)}, candidates={len(t_candidates)} torrents; "
-        f"skipped_active={meta['skipped_active']}, skipped_recent={meta['skipped_recent']}, "
-        f"skipped_min_age={meta['skipped_min_age']}, shield_skips={meta['skipped_shield']}.")
+    # Stage 1: filter + collect wanted sizes and candidate files, per instance
+    link_counts = None
+    if NLINK_ACCOUNTING and any(cyc['pending'] for _, cyc in work):
+        with METRICS.time('stage1'):
+            link_counts = count_download_links([inst.downloads_dir for inst in instances], host.fs)
+    wanted_sizes = set()
+    # Torrent files on a device without any media dir cannot be resolved by inode
+    hash_sizes = defaultdict(int)
+    for inst, cyc in work:
+        with inst.logging(), METRICS.time('stage1'):
+            cyc['stage1'] = [t for t in cyc['torrents'] if t['hash'] in cyc['pending']]
+            sizes, cyc['candidates'], meta = collect_torrent_candidates(
+                cyc['catalog'], cyc['stage1'], active_shield, inst.downloads_dir, host, link_counts)
+            wanted_sizes |= sizes
+            for cands in cyc['candidates'].values():
+                for cf in cands:
+                    if cf['dev'] not in walk.root_devs and not cf.get('local_only'):
+                        hash_sizes[cf['size']] += 1
+            log(f"🎯 Stage1: wanted_sizes={len(sizes)}, candidates={len(cyc['candidates'])} torrents; "
+                f"unchanged={len(cyc['torrents']) - len(cyc['pending'])}, skipped_active={meta['skipped_active']}, "
+                f"skipped_recent={meta['skipped_recent']}, skipped_min_age={meta['skipped_min_age']}, "
+                f"shield_skips={meta['skipped_shield']}, local_only_files={meta['local_only']}.")
+    if hash_sizes:
+        log(f"ℹ️ Quickhash fallback: {len(hash_sizes)} size(s) on devices without a media dir.")
 
     # Budget: we split between media and torrents dynamically; start with full, consume as we go
-    budget = Budget(HASH_BUDGET_MB)
-    # Stage 2: build media signature set only for sizes we actually care about
-    sig_set, idx_stats, _ = build_media_signature_set(wanted_sizes, budget)
+    # With a hash rate set, hashing is spread over the cycle's DEBUG_INTERVAL window and what
+    # does not fit is resumed next cycle
+    # Under load (LOAD_AWARE) budget, rate and workers shrink; the queue catches up when idle
+    if _HASH_RATE:
+        _HASH_RATE.scale = load_scale
+    budget = Budget(HASH_BUDGET_MB * load_scale, time.monotonic() + DEBUG_INTERVAL if _HASH_RATE else None,
+                    workers=1 if load_scale < 1 else HASH_WORKERS_PER_DEVICE)
+    # Quickhashes by inode, shared by media and torrent files and kept across config changes
+    state.prune_inode_hashes()
+    hcache = InodeHashCache(store, host.clock)
+    # Stage 2: build media link index only for sizes we actually care about, once for all instances
+    with METRICS.time('stage2'):
+        link_index, idx_stats = build_media_link_index(walk, store, hcache, wanted_sizes, hash_sizes, budget, host)
+    if state.watcher:
+        state.watcher.ack()
 
     # Whatever remains in the budget is available for torrent quickhashes
     TORRENT_HASH_BUDGET = budget  # pass the same budget into torrent hashing
 
-    # Load decision cache
-    tcache_path, tcache = load_torrent_cache()
+    # Stage 3: evaluate + tag using link index; one instance at a time, as they share the budget
+    for inst, cyc in work:
+        cyc['lookup'] = {t['hash']: {'name': t.get('name'), 'save_path': t.get('save_path')} for t in cyc['torrents']}
+        with inst.logging(), METRICS.time('evaluate'):
+            cyc['results'] = evaluate_and_tag(inst, cyc['stage1'], cyc['candidates'], link_index, cyc['lookup'],
+                                              run_id, host.now())
+
+    # Stage decisions and write the action log; commit when the checkpoint interval allows
+    with METRICS.time('checkpoint'):
+        state.checkpoint()
+        ACTION_LOG.flush()
+
+    for inst, cyc in work:
+        inst.table.ack()
+        results = cyc['results']
+        unchanged = len(cyc['torrents']) - len(cyc['pending'])
+        METRICS.inc('qbit_tagger_cache_lookups_total', results['skipped_reuse'] + unchanged, cache='decision', result='hit')
+        METRICS.inc('qbit_tagger_cache_lookups_total', len(cyc['pending']) - results['skipped_reuse'],
+                    cache='decision', result='miss')
+        decisions = defaultdict(int)
+        for h in cyc['lookup']:
+            ent = inst.tstate['entries'].get(h)
+            decisions[ent.get('decision') if ent else 'undecided'] += 1
+        for decision in ('orphan', 'linked', 'undecided'):
+            METRICS.set('qbit_tagger_torrents', decisions.get(decision, 0), decision=decision, **inst.labels)
+        with inst.logging():
+            log(f"📊 Summary: tagged={results['tagged']}, untagged={results['untagged']}, "
+                f"tag_writes={results['tag_writes']}, reuse_skips={results['skipped_reuse'] + unchanged}, "
+                f"inconclusive_skips={results['skipped_inconclusive']}, "
+                f"budget_used={idx_stats['budget_used_mb']}/{idx_stats['budget_total_mb']} MiB.")
+    METRICS.set('qbit_tagger_hash_budget_bytes', budget.total, kind='total')
+    METRICS.set('qbit_tagger_hash_budget_bytes', budget.total - budget.remaining, kind='used')
+    METRICS.observe('qbit_tagger_stage_seconds', time.monotonic() - cycle_start, stage='cycle')
+    METRICS.inc('qbit_tagger_cycles_total', result='ok')
+    METRICS.set('qbit_tagger_last_cycle_timestamp_seconds', int(time.time()))
+    log("Cleanup cycle complete.")
 
-    # Stage 3: evaluate + tag using signature set
-    results = evaluate_and_tag(qb, torrents, t_candidates, sig_set, idx_stats['index_complete'], tcache, torrent_lookup, run_id)
+_STOP = threading.Event()
 
-    # Save decision cache
-    save_torrent_cache(tcache_path, tcache)
-
-    log(f"📊 Summary: tagged={results['tagged']}, untagged={results['untagged']}, "
-        f"reuse_skips={results['skipped_reuse']}, inconclusive_skips={results['skipped_inconclusive']}, "
-        f"budget_used={idx_stats['budget_used_mb']}/{idx_stats['budget_total_mb']} MiB.")
-    log("Cleanup cycle complete.")
+def _on_signal(signum, frame):
+    if _STOP.is_set():
+        raise SystemExit(1)  # second signal: leave without flushing
+    log(f"Received signal {signum}; finishing the current cycle before exiting...")
+    _STOP.set()
 
 if __name__ == "__main__":
-    while True:
+    if sys.argv[1:2] == ['actions']:
+        # python qbit_cleanup.py actions <torrent hash | run id>...
+        for key in sys.argv[2:]:
+            for entry in ACTION_LOG.lookup(key):
+                print(json.dumps(entry, ensure_ascii=False))
+        raise SystemExit(0)
+    if sys.argv[1:2] == ['replay']:
+        # python qbit_cleanup.py replay CACHE_DIR/snapshots/cycle-<time>.tar.gz...
+        for path in sys.argv[2:]:
+            replay_snapshot(path)
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, _on_signal)
+    signal.signal(signal.SIGINT, _on_signal)
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT, METRICS_ADDR)
+    record = SNAPSHOT_RECORD
+    while not _STOP.is_set():
         try:
-            run_cleanup()
+            if record:
+                record = False
+                run_profiled(lambda: record_snapshot(run_cleanup))
+            else:
+                run_profiled(run_cleanup)
         except Exception as e:
             log(f"💥 Unhandled error: {e}")
+            METRICS.inc('qbit_tagger_cycles_total', result='error')
+        if _STOP.is_set():
+            break
         log(f"Waiting {DEBUG_INTERVAL} seconds before next run...")
-        time.sleep(DEBUG_INTERVAL)
+        _STOP.wait(DEBUG_INTERVAL)
+    ACTION_LOG.flush()
+    if _STATE is not None:
+        _STATE.close()
+    log("Cache store flushed; exiting.")